@@ -0,0 +1,286 @@
+#!/bin/env python
+# coding: utf8
+#
+# WhatIsMySchema
+#
+# Copyright (c) 2018 Tim Gubner
+#
+#
+
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import platform
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+from whatismyschema import *
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Generators for each column type, called with a random.Random
+column_types = {
+	"tinyint" : lambda rng: str(rng.randint(-128, 127)),
+	"smallint" : lambda rng: str(rng.randint(-32768, 32767)),
+	"int" : lambda rng: str(rng.randint(-2147483648, 2147483647)),
+	"bigint" : lambda rng: str(rng.randint(-9223372036854775808, 9223372036854775807)),
+	"decimal" : lambda rng: "{:.3f}".format(rng.uniform(-100000, 100000)),
+	"date" : lambda rng: (datetime(2000, 1, 1) + timedelta(days=rng.randint(0, 10000))).strftime("%Y-%m-%d"),
+	"datetime" : lambda rng: (datetime(2000, 1, 1) + timedelta(seconds=rng.randint(0, 10**9))).strftime("%Y-%m-%d %H:%M:%S"),
+	"varchar" : lambda rng: "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for i in range(rng.randint(1, 20))),
+}
+
+def generate(f, rows, types, null_ratio, seed, sep="|"):
+	"""
+	Writes <rows> deterministic rows with one column per entry in <types>
+	"""
+	rng = random.Random(seed)
+	gens = [column_types[t] for t in types]
+
+	for r in range(0, rows):
+		values = []
+		for gen in gens:
+			if null_ratio > 0 and rng.random() < null_ratio:
+				values.append("")
+			else:
+				values.append(gen(rng))
+		f.write(sep.join(values) + "\n")
+
+def measure(func, repeat):
+	"""
+	Best wall clock time of <repeat> runs
+	"""
+	best = None
+	for r in range(0, repeat):
+		start = time.time()
+		func()
+		t = time.time() - start
+		best = t if best is None else min(best, t)
+	return best
+
+def result(name, secs, rows, num_bytes, **params):
+	r = {"name" : name, "seconds" : secs, "rows" : rows, "bytes" : num_bytes,
+		"rows_per_sec" : rows / secs if secs > 0 else None,
+		"mb_per_sec" : num_bytes / secs / 2**20 if secs > 0 else None}
+	r.update(params)
+	return r
+
+def bench_push_line(lines, num_bytes, repeat):
+	def run():
+		table = Table()
+		for line in lines:
+			table.push_line(line)
+
+	return [result("push_line", measure(run, repeat), len(lines), num_bytes)]
+
+def bench_push_lines(lines, num_bytes, morsel_sizes, repeat):
+	"""
+	Batched pushes, as schema_main() hands morsels to tables
+	"""
+	r = []
+	for morsel_size in morsel_sizes:
+		def run():
+			table = Table()
+			for start in range(0, len(lines), morsel_size):
+				table.push_lines(lines[start:start + morsel_size])
+			table.flush()
+
+		r.append(result("push_lines", measure(run, repeat), len(lines), num_bytes,
+			morsel_size=morsel_size))
+
+	return r
+
+# Column push states and the generated types they stay in. The cached and
+# 'any' states are where every column starts, with or without cache.
+push_states = [
+	("cached", None),
+	("any", None),
+	("integer", ("tinyint", "smallint", "int", "bigint")),
+	("decimal", ("tinyint", "smallint", "int", "bigint", "decimal")),
+	("temporal", ("date", "datetime")),
+	("varchar", None)]
+
+def state_column(table, state):
+	"""
+	Fresh column of <table>, whose push_value() starts in <state>
+	"""
+	col = Column(table, None)
+	if state != "cached":
+		col.cache = None
+	if state in ("integer", "decimal", "varchar"):
+		(col.guess_date, col.guess_datetime) = (None, None)
+	if state in ("decimal", "temporal", "varchar"):
+		col.int_minmax = None
+	if state in ("temporal", "varchar"):
+		(col.decpre_minmax, col.decpost_minmax) = (None, None)
+	col._update_state()
+
+	assert(col.push_value.__name__ == "_push_" + state)
+	return col
+
+def bench_states(lines, types, repeat):
+	"""
+	Column.push_value() once per value, starting in each push state the
+	column's values stay in
+	"""
+	table = Table()
+
+	r = []
+	for (idx, tpe) in enumerate(types):
+		values = [line.rstrip("\n").split("|")[idx] for line in lines]
+		num_bytes = sum(len(v) for v in values)
+
+		for (state, state_types) in push_states:
+			if state_types is not None and tpe not in state_types:
+				continue
+
+			def run():
+				# push_value() changes with the state
+				col = state_column(table, state)
+				for v in values:
+					col.push_value(v)
+
+			r.append(result("push_value", measure(run, repeat), len(values), num_bytes,
+				column=idx, type=tpe, state=state))
+
+	return r
+
+def bench_end_to_end(path, num_bytes, rows, parallelism, chunk_sizes, modes, repeat):
+	r = []
+	script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "whatismyschema.py")
+
+	for mode in modes:
+		for num_parallel in parallelism:
+			for chunk_size in chunk_sizes:
+				if num_parallel == 1 and chunk_size != chunk_sizes[0]:
+					# Chunk size only matters for parallel runs
+					continue
+
+				cmd = [sys.executable, script, "-P", str(num_parallel),
+					"--parallel-chunk-size", str(chunk_size), "--parallel-mode", mode, path]
+
+				def run():
+					with open(os.devnull, 'w') as null:
+						subprocess.check_call(cmd, stdout=null)
+
+				r.append(result("schema_main", measure(run, repeat), rows, num_bytes,
+					parallelism=num_parallel, chunk_size=chunk_size, mode=mode))
+
+	return r
+
+def compare(results, old_path):
+	with open(old_path) as f:
+		old = json.load(f)
+
+	def key(res):
+		return tuple(sorted((k, v) for (k, v) in res.items()
+			if k not in ("seconds", "rows_per_sec", "mb_per_sec")))
+
+	old_results = dict((key(res), res) for res in old["results"])
+	for res in results:
+		prev = old_results.get(key(res))
+		if prev is None or not prev["seconds"]:
+			continue
+
+		print("{:14} {:40} {:8.3f}s -> {:8.3f}s ({:+.1f}%)".format(
+			res["name"], ",".join("{}={}".format(k, v) for (k, v) in sorted(res.items())
+				if k in ("type", "column", "state", "morsel_size", "parallelism", "chunk_size", "mode")),
+			prev["seconds"], res["seconds"],
+			100.0 * (res["seconds"] - prev["seconds"]) / prev["seconds"]))
+
+def int_list(s):
+	return [int(x) for x in s.split(",")]
+
+def main():
+	parser = argparse.ArgumentParser(
+		description="""Benchmarks WhatIsMySchema on generated data."""
+	)
+
+	parser.add_argument("--rows", dest="rows", type=int,
+		help="Number of generated rows. Default is 100k.", default="100000")
+	parser.add_argument("--types", dest="types", type=str,
+		help="Comma separated column types out of {}. Default is one of each.".format(
+			",".join(sorted(column_types))),
+		default="tinyint,smallint,int,bigint,decimal,date,datetime,varchar")
+	parser.add_argument("--columns", dest="columns", type=int,
+		help="Repeats the type mix until there are <COLUMNS> columns", default="0")
+	parser.add_argument("--null-ratio", dest="null_ratio", type=float,
+		help="Fraction of NULL values. Default is 0.05.", default="0.05")
+	parser.add_argument("--seed", dest="seed", type=int,
+		help="Seed of the generator", default="0")
+	parser.add_argument("--parallelism", dest="parallelism", type=int_list,
+		help="Comma separated degrees of parallelism for end to end runs. Default is 1,2,4.", default="1,2,4")
+	parser.add_argument("--parallel-chunk-size", dest="chunk_sizes", type=int_list,
+		help="Comma separated chunk sizes for end to end runs. Default is 1024,16384.", default="1024,16384")
+	parser.add_argument("--parallel-mode", dest="modes", type=str,
+		help="Comma separated parallel modes for end to end runs. Default is thread.", default="thread")
+	parser.add_argument("--repeat", dest="repeat", type=int,
+		help="Reports the best of <REPEAT> runs. Default is 3.", default="3")
+	parser.add_argument("--skip", dest="skip", type=str,
+		help="Comma separated benchmarks to skip out of push_line,push_lines,states,schema_main", default="")
+	parser.add_argument("-o", "--output", dest="output", type=str,
+		help="Writes results as JSON to <OUTPUT>", default="bench_output.json")
+	parser.add_argument("--compare", dest="compare", type=str,
+		help="Compares with results in JSON file <COMPARE> of an older version")
+
+	args = parser.parse_args()
+
+	types = args.types.split(",")
+	if args.columns > 0:
+		types = [types[i % len(types)] for i in range(0, args.columns)]
+	for t in types:
+		if t not in column_types:
+			parser.error("Unknown type '{}'".format(t))
+	skip = set(args.skip.split(","))
+
+	tmp = tempfile.mkdtemp()
+	try:
+		path = os.path.join(tmp, "bench.txt")
+		with open(path, 'w') as f:
+			generate(f, args.rows, types, args.null_ratio, args.seed)
+		with open(path, 'r') as f:
+			lines = f.readlines()
+		num_bytes = os.path.getsize(path)
+
+		results = []
+		if "push_line" not in skip:
+			results.extend(bench_push_line(lines, num_bytes, args.repeat))
+		if "push_lines" not in skip:
+			results.extend(bench_push_lines(lines, num_bytes, args.chunk_sizes, args.repeat))
+		if "states" not in skip:
+			results.extend(bench_states(lines, types, args.repeat))
+		if "schema_main" not in skip:
+			results.extend(bench_end_to_end(path, num_bytes, args.rows,
+				args.parallelism, args.chunk_sizes, args.modes.split(","), args.repeat))
+	finally:
+		shutil.rmtree(tmp)
+
+	for res in results:
+		print("{:14} {:40} {:12.0f} rows/s {:8.2f} MB/s".format(
+			res["name"], ",".join("{}={}".format(k, v) for (k, v) in sorted(res.items())
+				if k in ("type", "column", "state", "morsel_size", "parallelism", "chunk_size", "mode")),
+			res["rows_per_sec"] or 0, res["mb_per_sec"] or 0))
+
+	if args.compare:
+		compare(results, args.compare)
+
+	with open(args.output, 'w') as f:
+		json.dump({"python" : platform.python_version(),
+			"implementation" : platform.python_implementation(),
+			"numpy" : numpy is not None,
+			"cpus" : multiprocessing.cpu_count(),
+			"settings" : {"rows" : args.rows, "types" : types,
+				"null_ratio" : args.null_ratio, "seed" : args.seed},
+			"results" : results}, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+	main()
@@ -8,7 +8,11 @@
 #
 
 import unittest
+import tempfile
+import shutil
+import csv
 from whatismyschema import *
+from whatismyschema_client import send_message, recv_message
 
 class WhatIsMySchemaTestCase(unittest.TestCase):
 	def fix_type(self, t):
@@ -60,6 +64,40 @@ class TableTests(WhatIsMySchemaTestCase):
 		self.check_none_null(table.columns)
 		table.check()
 
+	def testDateFormats(self):
+		table = Table()
+		table.seperator = ","
+		table.date_formats.append("%d.%m.%Y")
+		table.datetime_formats.append("%d/%m/%Y %H:%M")
+		table.push("29.08.2013,2013-08-05 15:23:13,29/08/2013 12:00,2013-02-30")
+		table.push("1.8.2013,2013-08-06 15:23:14,1/8/2013 1:05,2013-02-28")
+
+		self.check_types(table.columns,
+			["date", "datetime", "datetime", "varchar(10)"])
+
+	def testFormatPrefilter(self):
+		fmts = Table.default_date_formats + Table.default_datetime_formats + [
+			"%d.%m.%Y", "%b %d %Y", "%Y%m%d"]
+		values = ["2013-08-29", "2013-8-9", "2013-08-29 1:2:3", "2013-08-29 01:02:03.123",
+			"29.08.2013", " 9.08.2013", "aug 29 2013", "Aug 29 2013", "20130829",
+			"2013-08-29 ", "2013-13-29", "42", "", "2013-08-29\t01:02:03",
+			"2013-02-29", "2012-02-29", "0000-01-01", "2013-08-29 24:00:00", "2013-08-29 23:59:60",
+			"2013-08-29 01:02:03.", "2013-00-10", "2013131", "2013-08-29 01:02:03.1234567"]
+
+		guess = DateTimeFormatTryAndError([])
+		for fmt in fmts:
+			matcher = compile_format(fmt)
+			for val in values:
+				try:
+					datetime.strptime(val, fmt)
+					matched = True
+				except ValueError:
+					matched = False
+
+				if matched:
+					self.assertTrue(matcher(val) is not None, (fmt, val))
+				self.assertEqual(guess.match_format(val, fmt) is not None, matched)
+
 	def testSep1(self):
 		table = Table()
 		table.seperator = "seperator"
@@ -121,6 +159,8 @@ class TableTests(WhatIsMySchemaTestCase):
 			["tinyint", "tinyint"])
 
 		self.check_null(table.columns, [False, True])
+		self.assertEqual(table.columns[1].num_nulls, 2)
+		self.assertEqual(table.columns[1].num_values, 3)
 		table.check()
 
 	def testIssue4(self):
@@ -147,6 +187,25 @@ class TableTests(WhatIsMySchemaTestCase):
 		self.check_null(table.columns, [False, False, False])
 		table.check()
 
+	def testLongNumbers(self):
+		table = Table()
+		table.seperator = "|"
+		table.push("{}|-{}|{}.{}|0000000000000000000000042".format(
+			"9" * 10000, "1" * 19, "1" * 5000, "0" * 5000))
+
+		self.check_types(table.columns, [
+			"decimal(10000, 0)", "bigint", "decimal(5000, 0)", "tinyint"])
+
+		for (v, expect) in [("", (None, (0, 0))), ("-.5", (None, (0, 1))),
+				("007", (7, (1, 0))), (b"+01.50", (None, (1, 1))),
+				("1" * 21, (None, (21, 0))), ("-" + "0" * 30 + "1", (-1, (1, 0))),
+				("1e5", None), (" 12", None), ("1.2.3", None)]:
+			self.assertEqual(scan_number(v), expect)
+			if expect is not None:
+				self.assertEqual(decimal_digits(v), expect[1])
+		self.assertEqual(decimal_digits("1.2.3"), None)
+		table.check()
+
 	def testIssue7a(self):
 		table = Table()
 		table.seperator = "|"
@@ -198,9 +257,827 @@ class TableTests(WhatIsMySchemaTestCase):
 		self.check_null(table.columns, [False, True, False])
 		table.check()
 
+	def testMergeNulls(self):
+		a = Table()
+		a.push("1|x")
+		a.push("2|y")
+
+		b = Table()
+		b.push("3|")
+		b.push("4")
+
+		a.merge(b)
+
+		self.check_types(a.columns,
+			["tinyint", "varchar(1)"])
+
+		self.check_null(a.columns, [False, True])
+		self.assertEqual(a.line_number, 4)
+		self.assertEqual(a.columns[0].num_values, 4)
+		a.check()
+
+	def testMergeFormats(self):
+		a = Table()
+		a.push("2013-08-05 15:23:13.716532")
+
+		b = Table()
+		b.push("2013-08-05 15:23:13")
+
+		a.merge(b)
+
+		self.check_types(a.columns, ["varchar(26)"])
+
+	def testPickle(self):
+		table = Table()
+		table.seperator = ","
+		table.push("1,2013-08-29,1.5,")
+
+		clone = pickle.loads(pickle.dumps(table, pickle.HIGHEST_PROTOCOL))
+		clone.push("2,2013-08-30,12.25,")
+
+		self.check_types(clone.columns,
+			["tinyint", "date", "decimal(4,2)", "boolean"])
+		self.check_null(clone.columns, [False, False, False, True])
+		self.assertEqual(clone.seperator, ",")
+		self.assertEqual(clone.line_number, 2)
+
+	def testEliminated(self):
+		a = Table()
+		a.push("1")
+		a.push("1.5")
+		a.push("x")
+
+		b = Table()
+		b.push("2")
+		b.push("3")
+
+		col = a.columns[0]
+		self.assertEqual(col.eliminated, {"integer" : 2, "decimal" : 3, "date" : 1, "datetime" : 1})
+
+		b.merge(a)
+		col = b.columns[0]
+		self.assertEqual(col.eliminated, {"integer" : 4, "decimal" : 5, "date" : 2, "datetime" : 2})
+
+		# Batches count up to the eliminating value, for single columns
+		# and matrices
+		for width in [1, Table.matrix_width]:
+			for (values, expect) in [
+					(["7"] * 100 + [""] * 50 + ["1.5"] + ["x"] * 49,
+						{"integer" : 151, "decimal" : 152, "date" : 1, "datetime" : 1}),
+					(["2013-08-29"] * 70 + ["2013-02-30"] * 30,
+						{"integer" : 1, "decimal" : 1, "date" : 71, "datetime" : 1})]:
+				table = Table()
+				table.push_lines(["|".join([v] * width) for v in values])
+				for col in table.columns:
+					self.assertEqual(col.eliminated, expect)
+
+	def testStats(self):
+		push_lines = Table.__dict__["push_lines"]
+		stats = Stats()
+		stats.install()
+		try:
+			table = Table()
+			table.push_lines(["1|2013-08-29"] * 10)
+			table.merge(Table())
+			report = stats.report(table)
+		finally:
+			stats.uninstall()
+
+		self.assertEqual(report["stages"]["push"]["calls"], 1)
+		self.assertEqual(report["stages"]["merge"]["calls"], 1)
+		self.assertTrue(report["stages"]["date match"]["calls"] > 0)
+		self.assertEqual(report["columns"][1]["eliminated_after"]["date"], None)
+		self.assertTrue(Table.__dict__["push_lines"] is push_lines)
+
+	def testProfiles(self):
+		a = Table()
+		a.push("1|x")
+
+		b = Table()
+		b.push("300|2013-08-29|y")
+
+		tmp = tempfile.mkdtemp()
+		try:
+			paths = [os.path.join(tmp, "a"), os.path.join(tmp, "b")]
+			save_profile(paths[0], a)
+			save_profile(paths[1], b)
+
+			table = merge_profiles(paths)
+			self.check_types(table.columns,
+				["smallint", "varchar(10)", "varchar(1)"])
+			self.check_null(table.columns, [False, False, True])
+			self.assertEqual(table.line_number, 2)
+
+			# Profiles are plain JSON
+			with open(paths[0], 'r') as f:
+				state = json.load(f)
+			state["table"] = {"class" : "FileDriver", "state" : []}
+			with open(paths[0], 'w') as f:
+				json.dump(state, f)
+			self.assertRaises(ValueError, load_profile, paths[0])
+
+			b.seperator = ","
+			save_profile(paths[0], a)
+			save_profile(paths[1], b)
+			self.assertRaises(ValueError, merge_profiles, paths)
+
+			with open(paths[0], 'w') as f:
+				f.write("1|x\n")
+			self.assertRaises(ValueError, load_profile, paths[0])
+		finally:
+			shutil.rmtree(tmp)
+
+	def testDistinct(self):
+		lines = ["{}|{}|{}".format(i, i % 10, "" if i % 2 else i) for i in range(20000)]
+
+		single = Table()
+		single.distinct = True
+		for line in lines:
+			single.push_line(line)
+
+		(a, b) = (Table(), Table())
+		a.distinct = b.distinct = True
+		a.push_lines(lines[:5000])
+		b.push_lines(lines[5000:])
+		a.merge(b)
+		a = pickle.loads(pickle.dumps(a))
+
+		for (s, m) in zip(single.columns, a.columns):
+			self.assertEqual(s.distinct.registers, m.distinct.registers)
+
+		estimates = [col.distinct.estimate() for col in a.columns]
+		self.assertTrue(abs(estimates[0] - 20000) < 1000, estimates)
+		self.assertEqual(estimates[1], 10)
+		self.assertTrue(abs(estimates[2] - 10000) < 500, estimates)
+
+		plain = Table()
+		plain.push("1")
+		self.assertEqual(plain.columns[0].distinct, None)
+
+	def testValidate(self):
+		schema = load_schema(['CREATE TABLE "t" (', "a tinyint NOT NULL,",
+			"b decimal(4, 2), -- ~3 distinct", "c date,", "d varchar(3)", ");"])
+		self.assertEqual(schema, [("a", "tinyint", False), ("b", "decimal(4, 2)", True),
+			("c", "date", True), ("d", "varchar(3)", True)])
+		self.assertRaises(ValueError, load_schema, ["a varchar(3"])
+		self.assertRaises(ValueError, Validator, [("a", "varchar", True)], 1)
+		self.assertRaises(ValueError, Validator, [("a", "decimal(4)", True)], 1)
+
+		good = ["1|12.34|2013-08-29|abc", "-5||2013-08-30|", "7|1|"] * 100
+		bad = ["1|123.4|2013-08-29|abc", "|1|2013-02-30|abcd|x"]
+
+		for (quote, max_violations) in [(None, 0), (None, 2), ('"', 0)]:
+			validator = Validator(schema, max_violations)
+			validator.quote = quote
+			validator.compile()
+			validator.push_lines(good)
+			self.assertEqual(validator.violations, [])
+			self.assertEqual(validator.line_number, 300)
+
+			validator.push_lines(good + bad + good)
+			expect = [(None, 601, 1, "123.4"), (None, 602, 0, ""), (None, 602, 2, "2013-02-30"),
+				(None, 602, 3, "abcd"), (None, 602, 4, "x")]
+			self.assertEqual(validator.violations, expect[:max_violations or len(expect)])
+
+		# Dates need a common format
+		validator = Validator([("c", "date", True)], 0)
+		validator.date_formats.append("%d.%m.%Y")
+		validator.compile()
+		validator.push_lines(["2013-08-29"] * 100 + ["29.08.2013"])
+		self.assertEqual(validator.violations, [(None, 101, 0, "29.08.2013")])
+
+	def testSplitQuoted(self):
+		self.assertEqual(split_quoted('a|"b|c"|d', '|', '"'), ["a", "b|c", "d"])
+		self.assertEqual(split_quoted('"a ""x"""|', '|', '"'), ['a "x"', ""])
+		self.assertEqual(split_quoted('"a', '|', '"'), ["a"])
+		self.assertEqual(split_quoted(b'1|"2"', b'|', b'"'), [b"1", b"2"])
+		self.assertEqual(split_quoted('1|12" screen', '|', '"'), ["1", '12" screen'])
+
+	def testInQuotes(self):
+		for (line, quoted, expect) in [
+				('1|"a', False, True), ('1|"a|b"', False, False), ('"a""|', False, True),
+				('1|12" screen', False, False), ('1|a"b|"c', False, True),
+				('"x"y"|2', False, False), ('x|1', True, True), ('x"|"2', True, True),
+				('x"', True, False), ('"', True, False), ('""', True, True)]:
+			self.assertEqual(in_quotes(line, '|', '"', quoted), expect, line)
+			self.assertEqual(in_quotes(line.encode('utf8'), b'|', b'"', quoted), expect)
+
+	def testQuoted(self):
+		lines = ['1|"a|b"', '2|"multi', 'line"', '3|""""']
+		for push_lines in [False, True]:
+			table = Table()
+			table.quote = '"'
+			if push_lines:
+				table.push_lines(lines)
+			else:
+				for line in lines:
+					table.push_line(line + "\n")
+			table.flush()
+			table.check()
+
+			self.assertEqual(table.line_number, 3)
+			self.check_types(table.columns, ["tinyint", "varchar(10)"])
+			self.check_none_null(table.columns)
+
+		# Quotes within unquoted fields are literal, as with the csv module
+		lines = ['1|12" screen'] + ["{}|tv".format(i) for i in range(0, 1000)]
+		rows = list(csv.reader(lines, delimiter='|', quotechar='"'))
+		self.assertEqual((len(rows), set(len(row) for row in rows)), (1001, set([2])))
+		for push_lines in [False, True]:
+			table = Table()
+			table.quote = '"'
+			if push_lines:
+				table.push_lines(lines)
+			else:
+				for line in lines:
+					table.push_line(line + "\n")
+			table.flush()
+			table.check()
+
+			self.assertEqual(table.line_number, 1001)
+			self.check_types(table.columns, ["smallint", "varchar(10)"])
+
+
+class BatchTests(WhatIsMySchemaTestCase):
+	def column_state(self, col):
+		r = []
+		for mm in [col.int_minmax, col.decpre_minmax, col.decpost_minmax, col.len_minmax]:
+			r.append(None if mm is None else (mm.dmin, mm.dmax))
+		r.append(col.guess_date is None)
+		r.append(col.guess_datetime is None)
+		r.append((col.num_values, col.num_nulls))
+		return r
+
+	def check_batch(self, values):
+		lines = ["|".join(row) for row in zip(*values)]
+
+		batch = Table()
+		batch.push_lines(lines)
+
+		single = Table()
+		for line in lines:
+			single.push_line(line)
+
+		self.assertEqual(batch.line_number, single.line_number)
+		self.assertEqual(len(batch.columns), len(single.columns))
+		for (b, s) in zip(batch.columns, single.columns):
+			self.assertEqual(self.column_state(b), self.column_state(s))
+			self.assertEqual(b.determine_type(), s.determine_type())
+
+	def testBatch1(self):
+		self.check_batch(self.batch_values())
+
+	def testMatrix(self):
+		(matrix_width, matrix_chars) = (Table.matrix_width, Table.matrix_chars)
+		try:
+			Table.matrix_width = 1
+			for chars in [matrix_chars, 1000]:
+				Table.matrix_chars = chars
+				values = self.batch_values()
+				self.check_batch(values)
+				self.check_batch(values[:-1])
+				self.check_batch([["", "1"] * 100, ["x"] * 200])
+		finally:
+			(Table.matrix_width, Table.matrix_chars) = (matrix_width, matrix_chars)
+
+	def testBinary(self):
+		values = self.batch_values()
+		values.append([u"\u00e4", u"\u00e4\u00f6", "x", "NULL"] * 50)
+		lines = ["|".join(row) for row in zip(*values)]
+
+		text = Table()
+		text.parent_null_value = "NULL"
+		text.push_lines(lines)
+
+		for batch in [True, False]:
+			binary = Table()
+			binary.binary = True
+			binary.parent_null_value = "NULL"
+
+			blines = [l.encode('utf8') for l in lines]
+			if batch:
+				binary.push_lines(blines)
+			else:
+				for line in blines:
+					binary.push_line(line)
+
+			self.assertEqual(len(binary.columns), len(text.columns))
+			for (b, t) in zip(binary.columns, text.columns):
+				self.assertEqual(self.column_state(b), self.column_state(t))
+				self.assertEqual(b.determine_type(), t.determine_type())
+
+	def batch_values(self):
+		n = 200
+		return [
+			[str(i - 100) for i in range(n)],
+			["+{}.{}0".format(i, i) for i in range(n)],
+			["" if i % 3 else "00{}".format(i) for i in range(n)],
+			["-.5", "+", "1.", "."] * (n // 4),
+			["1" * 30] + ["2"] * (n-1),
+			["2013-08-29"] * n,
+			["12", " 12", "1_0", "1e5"] * (n // 4),
+			["1.2.3"] + ["4"] * (n-1),
+			["1-2"] + ["4"] * (n-1),
+			[u"\u0663", "1", "1.\u0663", "x"] * (n // 4),
+		]
+
+	def testStates(self):
+		table = Table()
+		sequences = [
+			["1", "-2", "+3", "007", "1.5", "x"],
+			["1", " 2", "3.25", "1e5"],
+			["2013-08-29", "1", "2"],
+			["1", "2013-08-29"],
+			[".5", "-1", "12", "1.2.3"],
+			["", "1", "", "abc", "12345"],
+			[u"\u0663", "12", "1.\u0663"],
+		]
+
+		for values in sequences:
+			col = Column(table, None)
+			ref = Column(table, None)
+			for attr in values:
+				col.push_attribute(attr, table)
+
+				# Reference always runs all checks
+				ref.push_value = ref._push_any
+				ref.push_attribute(attr, table)
+
+				self.assertEqual(self.column_state(col), self.column_state(ref))
+
+		col = Column(table, None)
+		for attr in ["1", "x"]:
+			col.push_attribute(attr, table)
+		self.assertEqual(col.push_value, col._push_varchar)
+
+	def testCache(self):
+		table = Table()
+		table.cache_size = 4
+		for i in range(0, 100):
+			table.push("2013-08-0{}|2013-{:02d}-{:02d}".format(i % 3 + 1, i % 12 + 1, i % 28 + 1))
+
+		(dates, distinct) = table.columns
+		self.check_types(table.columns, ["date", "date"])
+		self.assertEqual(dates.cache_misses, 3)
+		self.assertEqual(dates.cache_hits, 97)
+
+		# Values hardly repeat
+		self.assertTrue(distinct.cache is None)
+
+		other = Table()
+		other.cache_size = 4
+		other.push("2013-08-01 00:00:00|2013-01-01")
+		table.merge(other)
+
+		self.check_types(table.columns, ["varchar(19)", "date"])
+		self.assertEqual(dates.cache_misses, 4)
+		self.assertTrue(dates.cache is None)
+
+	def testBatchRagged(self):
+		table = Table()
+		table.push_lines(["1|2"] * 100 + ["3"] * 100)
+		table.check()
+
+		self.check_types(table.columns, ["tinyint", "tinyint"])
+		self.check_null(table.columns, [False, True])
+		self.assertEqual(table.columns[1].num_nulls, 100)
+
+
+class DriverTests(WhatIsMySchemaTestCase):
+	class Args(object):
+		chunk_size = 7
+		begin = 0
+		binary = False
+		quote = None
+		seperator = "|"
+		null = ""
+		date_formats = None
+		datetime_formats = None
+		cache_size = 4096
+		colnamefile = None
+		colnamecmd = None
+		distinct = False
+		checkpoint = None
+		checkpoint_interval = 0
+
+	def file_path(self, name):
+		return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+	def testRangeSplit(self):
+		path = self.file_path("test1.txt")
+		with open(path, 'r') as f:
+			expect = [l.rstrip('\n') for l in f]
+
+		min_size = RangeDriver.min_size
+		block_size = RangeDriver.block_size
+		RangeDriver.min_size = 1
+		RangeDriver.block_size = 100
+		try:
+			for begin in [0, 1, 5]:
+				for num_ranges in [1, 2, 3, 17, 1000]:
+					args = self.Args()
+					args.begin = begin
+					args.chunk_size = 3 + begin
+					driver = FileDriver(None, args, path)
+					self.assertTrue(driver.splittable())
+
+					lines = []
+					for rdriver in driver.split(num_ranges):
+						while True:
+							morsel = rdriver.nextMorsel()
+							if morsel is None:
+								break
+							self.assertTrue(0 < len(morsel) <= args.chunk_size)
+							lines.extend(morsel)
+
+					self.assertEqual(lines, expect[begin:])
+		finally:
+			RangeDriver.min_size = min_size
+			RangeDriver.block_size = block_size
+
+		# Ranges past the end of a truncated file
+		size = os.path.getsize(path)
+		for (start, realign) in [(0, False), (size // 2, True), (size + 10, True)]:
+			rdriver = RangeDriver(path, start, size + 100, realign, 3)
+			lines = []
+			while True:
+				morsel = rdriver.nextMorsel()
+				if morsel is None:
+					break
+				lines.extend(morsel)
+			self.assertEqual(lines, expect[len(expect) - len(lines):])
+			self.assertEqual(len(lines) == len(expect), start == 0)
+
+	def testRangeTuples(self):
+		path = self.file_path("test1.txt")
+		with open(path, 'r') as f:
+			expect = [l.rstrip('\n') for l in f]
+
+		driver = FileDriver(None, self.Args(), path)
+		(rdriver, ) = driver.split(1)
+
+		lines = []
+		while True:
+			l = rdriver.nextTuple()
+			if l is None:
+				break
+			lines.append(l)
+
+		self.assertEqual(lines, expect)
+
+
+	def testCompressed(self):
+		path = self.file_path("test1.txt")
+		with open(path, 'rb') as f:
+			data = f.read()
+		expect = data.decode('utf8').split('\n')
+
+		tmp = tempfile.mkdtemp()
+		try:
+			for (name, opener) in [("t.gz", gzip.open), ("t.bz2", bz2.BZ2File), ("t.txt", open)]:
+				fn = os.path.join(tmp, name)
+				with closing(opener(fn, 'wb')) as f:
+					f.write(data)
+
+				reader = detect_compression(fn)
+				self.assertEqual(reader is None, name == "t.txt")
+
+				# Small blocks cut lines
+				for (begin, block_size) in [(0, StreamDriver.block_size), (3, StreamDriver.block_size), (0, 5)]:
+					args = self.Args()
+					args.begin = begin
+
+					lines = []
+					(default_size, StreamDriver.block_size) = (StreamDriver.block_size, block_size)
+					try:
+						driver = StreamDriver(fn, reader or open_raw, args, 2)
+						while True:
+							morsel = driver.nextMorsel()
+							if morsel is None:
+								break
+							self.assertTrue(len(morsel) <= args.chunk_size)
+							lines.extend(morsel)
+					finally:
+						StreamDriver.block_size = default_size
+
+					self.assertEqual(lines, expect[begin:])
+
+			self.assertTrue(detect_compression(path) is None)
+		finally:
+			shutil.rmtree(tmp)
+
+	def testStreamClose(self):
+		# The producer blocks on the full queue after the first morsels
+		streams = []
+		def opener(path):
+			streams.append(io.BytesIO(b"1|a\n" * 100000))
+			return streams[-1]
+
+		(default_size, StreamDriver.block_size) = (StreamDriver.block_size, 64)
+		try:
+			driver = StreamDriver(None, opener, self.Args(), 1)
+			self.assertTrue(len(driver.nextMorsel()) > 0)
+			driver.close()
+			driver.thread.join(10)
+		finally:
+			StreamDriver.block_size = default_size
+
+		self.assertFalse(driver.thread.is_alive())
+		self.assertTrue(streams[0].closed)
+		self.assertEqual(driver.nextMorsel(), None)
+
+	def testSample(self):
+		path = self.file_path("test1.txt")
+		args = self.Args()
+		args.begin = 1
+		driver = FileDriver(None, args, path)
+
+		blocks = driver.sample(2, 100, random.Random(42))
+		self.assertEqual(len(blocks), 2)
+
+		for block in blocks:
+			lines = block.nextMorsel()
+			self.assertTrue(len(lines) > 0)
+			for line in lines:
+				self.assertTrue(line.count("|") == 2)
+
+			# Blocks close their file once read to the end
+			while block.nextMorsel() is not None:
+				pass
+			self.assertEqual(block.file, None)
+
+	def testQuotedMorsels(self):
+		tmp = tempfile.mkdtemp()
+		try:
+			fn = os.path.join(tmp, "t.csv")
+			with open(fn, 'w') as f:
+				for i in range(0, 50):
+					f.write('{}|"x\n\n{}"\n'.format(i, i))
+
+			# Quotes within unquoted fields do not join records
+			stray = os.path.join(tmp, "stray.csv")
+			with open(stray, 'w') as f:
+				f.write('1|12" screen\n' + "2|tv\n" * 149)
+
+			args = self.Args()
+			args.quote = '"'
+			block_size = RangeDriver.block_size
+			RangeDriver.block_size = 10
+			try:
+				self.check_quoted_morsels(fn, args)
+				self.check_quoted_morsels(stray, args, args.chunk_size)
+			finally:
+				RangeDriver.block_size = block_size
+		finally:
+			shutil.rmtree(tmp)
+
+	def check_quoted_morsels(self, fn, args, max_size=None):
+		with open(fn, 'r') as f:
+			stream = FileDriver(f, args)
+			self.assertFalse(stream.splittable())
+			(mapped, ) = FileDriver(None, args, fn).split(1)
+			producer = StreamDriver(fn, open_raw, args, 2)
+
+			for driver in [stream, mapped, producer]:
+				num_lines = 0
+				while True:
+					morsel = driver.nextMorsel()
+					if morsel is None:
+						break
+					self.assertFalse(lines_in_quotes(morsel, args.seperator, args.quote))
+					if max_size is not None:
+						self.assertTrue(len(morsel) <= max_size)
+					num_lines += len(morsel)
+				self.assertEqual(num_lines, 150)
+
+	def testPlan(self):
+		path = self.file_path("test1.txt")
+		tmp = tempfile.mkdtemp()
+		try:
+			small = os.path.join(tmp, "small.txt")
+			with open(small, 'w') as f:
+				f.write("1|2|3\n")
+
+			args = self.Args()
+			args.begin = 1
+			stream = FileDriver(open(small, 'r'), args)
+			drivers = [FileDriver(None, args, small), stream, FileDriver(None, args, path)]
+
+			min_size = RangeDriver.min_size
+			RangeDriver.min_size = 1
+			try:
+				(ranges, streams) = plan_drivers(drivers, 2)
+			finally:
+				RangeDriver.min_size = min_size
+
+			self.assertTrue(streams == [stream])
+			sizes = [r.end - r.start for r in ranges]
+			self.assertEqual(sizes, sorted(sizes, reverse=True))
+			self.assertEqual(ranges[-1].path, small)
+
+			tasks = deque(ranges + streams)
+			table = steal_loop(Table(), tasks, None)
+			stream.file.close()
+
+			expect = Table()
+			with open(path, 'r') as f:
+				for line in f.readlines()[1:]:
+					expect.push_line(line)
+			self.assertEqual(table.line_number, expect.line_number)
+			self.assertEqual(schema_types(table), schema_types(expect))
+		finally:
+			shutil.rmtree(tmp)
+
+	def testProgress(self):
+		path = self.file_path("test1.txt")
+		(driver, ) = FileDriver(None, self.Args(), path).split(1)
+		table = Table()
+
+		with tempfile.TemporaryFile(mode='w+') as out:
+			progress = Progress(60, True, out)
+			progress.watch([driver, driver], [table])
+			progress.last = progress.sample()
+			self.assertEqual(progress.last[1:4], (0, 0, os.path.getsize(path)))
+
+			driver_loop(table, driver, True, progress.worker())
+			self.assertEqual(progress.sample()[1:4],
+				(table.line_number, os.path.getsize(path), os.path.getsize(path)))
+
+			progress.report()
+			out.seek(0)
+			lines = out.read().splitlines()
+			self.assertTrue(lines[0].startswith("{} rows".format(table.line_number)))
+			self.assertTrue("100.0%" in lines[0])
+			self.assertEqual(lines[1], "  col0 varchar(5), col1 varchar(2), col2 varchar(3)")
+
+		# Snapshots only copy tables between morsels
+		table.push("xxxxxx")
+		self.assertEqual(progress.snapshot(), [("col0", "varchar(5)"),
+			("col1", "varchar(2)"), ("col2", "varchar(3)")])
+		progress.offer(table)
+		self.assertEqual(progress.snapshot()[0], ("col0", "varchar(6)"))
+
+		# Ranges read by other processes count once finished
+		ranges = FileDriver(None, self.Args(), path).split(2)
+		finished = FinishedRanges(ranges)
+		finished.finish(ranges[1])
+		self.assertEqual(finished.progress(),
+			(0, ranges[1].end - ranges[1].start, os.path.getsize(path)))
+
+	def testCheckpoint(self):
+		tmp = tempfile.mkdtemp()
+		try:
+			fn = os.path.join(tmp, "log.txt")
+			args = self.Args()
+			args.checkpoint = os.path.join(tmp, "checkpoint")
+			args.files = [fn]
+
+			with open(fn, 'w') as f:
+				f.write("1|a\n2|b\n")
+			table = schema_main_checkpoint(Table(), args)
+			self.check_types(table.columns, ["tinyint", "varchar(1)"])
+
+			# Only appended rows are read
+			with open(fn, 'a') as f:
+				f.write("300|hello\n")
+			table = schema_main_checkpoint(Table(), args)
+			self.check_types(table.columns, ["smallint", "varchar(5)"])
+			self.assertEqual(table.line_number, 3)
+
+			# Unfinished last lines are read, but only checkpointed once
+			# complete
+			with open(fn, 'a') as f:
+				f.write("5|zzzzzz")
+			for i in range(0, 2):
+				table = schema_main_checkpoint(Table(), args)
+				self.check_types(table.columns, ["smallint", "varchar(6)"])
+				self.assertEqual(table.line_number, 4)
+			with open(fn, 'a') as f:
+				f.write("000|y\n")
+			table = schema_main_checkpoint(Table(), args)
+			self.check_types(table.columns, ["smallint", "varchar(9)", "varchar(1)"])
+			self.assertEqual(table.line_number, 4)
+
+			# Replaced files invalidate the checkpoint
+			with open(fn, 'w') as f:
+				f.write("x|1\n")
+			table = schema_main_checkpoint(Table(), args)
+			self.check_types(table.columns, ["varchar(1)", "tinyint"])
+			self.assertEqual(table.line_number, 1)
+		finally:
+			shutil.rmtree(tmp)
+
+	def testResultCache(self):
+		tmp = tempfile.mkdtemp()
+		try:
+			cache_dir = os.path.join(tmp, "cache")
+			files = [os.path.join(tmp, "a.txt"), os.path.join(tmp, "b.txt")]
+			for fn in files:
+				with open(fn, 'w') as f:
+					f.write("1|a\n")
+
+			parser = build_parser()
+			args = parser.parse_args(["--result-cache", cache_dir] + files)
+			table = schema_main(Table(), args)
+			self.check_types(table.columns, ["tinyint", "varchar(1)"])
+			self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+			# Cached states are used, even if the file is scanned differently
+			cache = ResultCache(cache_dir, args)
+			stale = cache.load(cache.key(files[0]))
+			stale.push("x|yyy")
+			cache.store(cache.key(files[0]), stale)
+			table = schema_main(Table(), args)
+			self.check_types(table.columns, ["varchar(1)", "varchar(3)"])
+			self.assertEqual(table.line_number, 3)
+
+			# Changed files are scanned again
+			with open(files[0], 'w') as f:
+				f.write("300|b\n")
+			table = schema_main(Table(), args)
+			self.check_types(table.columns, ["smallint", "varchar(1)"])
+			self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+			args.result_cache_limit = 0
+			schema_main(Table(), args)
+			self.assertEqual(len(os.listdir(cache_dir)), 0)
+
+			args.result_cache_limit = 1
+			schema_main(Table(), args)
+			cache.clear()
+			self.assertEqual(len(os.listdir(cache_dir)), 0)
+		finally:
+			shutil.rmtree(tmp)
+
+	def testServeJob(self):
+		parser = build_parser()
+		cwd = os.path.dirname(os.path.abspath(__file__))
+		before = os.getcwd()
+
+		table = Table()
+		table.push("1|x")
+		(fd, profile) = tempfile.mkstemp()
+		os.close(fd)
+		save_profile(profile, table)
+
+		for (argv, stdin, status, out) in [
+				(["test1.txt"], None, 0, "col0 varchar(5) NOT NULL"),
+				(["--null", "x"], b"1|x\n2|3\n", 0, "col0 tinyint NOT NULL\ncol1 tinyint\n"),
+				(["merge", profile], None, 0, "col0 tinyint NOT NULL\ncol1 varchar(1) NOT NULL"),
+				(["merge", profile, "--bogus"], None, 2, ""),
+				(["--bogus"], None, 2, "")]:
+			(server, client) = socket.socketpair()
+			with closing(server), closing(client):
+				request = {"argv" : argv, "cwd" : cwd, "tty" : False}
+				if stdin is not None:
+					client.sendall(stdin)
+				client.shutdown(socket.SHUT_WR)
+
+				response = serve_job(server, request, parser)
+				self.assertEqual(recv_message(client), {"stdin" : stdin is not None})
+
+			self.assertEqual(response["status"], status)
+			self.assertTrue(response["stdout"].startswith(out))
+			if status == 0:
+				self.assertEqual(response["columns"][0]["name"], "col0")
+			else:
+				self.assertTrue("--bogus" in response["stderr"])
+		self.assertEqual(os.getcwd(), before)
+		os.unlink(profile)
+
+	def testBatch(self):
+		tmp = tempfile.mkdtemp()
+		try:
+			files = [os.path.join(tmp, "{}.txt".format(i)) for i in range(0, 20)]
+			for (i, fn) in enumerate(files):
+				with open(fn, 'w') as f:
+					f.write("{}|a\n".format(i * 100) * (i + 1))
+
+			tasks = plan_batch(files, 2)
+			self.assertEqual(sorted(sum(tasks, [])), sorted(files))
+			self.assertTrue(len(tasks) > 1)
+			self.assertEqual(tasks[0][0], files[-1])
+
+			args = build_parser().parse_args(["--batch", "jsonl", "-P", "1",
+				os.path.join(tmp, "missing.txt")] + files)
+			results = sum([batch_task((args, ["x"], paths, os.getcwd())) for paths in plan_batch(args.files, 1)], [])
+			self.assertEqual(len(results), 21)
+			for (fn, table, error) in results:
+				if fn not in files:
+					self.assertTrue(table is None and error is not None)
+					continue
+
+				self.assertEqual(error, None)
+				self.assertEqual(table_columns(table), [
+					{"name" : "x", "type" : "smallint" if files.index(fn) > 1 else "tinyint",
+						"nullable" : False},
+					{"name" : "col1", "type" : "varchar(1)", "nullable" : False}])
+		finally:
+			shutil.rmtree(tmp)
+
 
 class CliTests(WhatIsMySchemaTestCase):
-	def run_process(self, cmd, file):
+	def run_process(self, cmd, file, check_err=True):
 		path = os.path.dirname(os.path.abspath(__file__))
 		p = subprocess.Popen("python {path}/whatismyschema.py{sep}{cmd}{sep}{path}/{file}".format(
 			path=path, cmd=cmd, file=file,
@@ -216,7 +1093,9 @@ class CliTests(WhatIsMySchemaTestCase):
 			if out is None:
 				out = ""
 			
-			self.assertEqual(0, len(err.decode('utf8').strip()))
+			self.err = err.decode('utf8').strip()
+			if check_err:
+				self.assertEqual(0, len(self.err))
 			return self.fix_type(out.decode('utf8').strip())
 
 	def testParallel1(self):
@@ -235,6 +1114,130 @@ class CliTests(WhatIsMySchemaTestCase):
 					else:
 						assert(False)
 
+	def testSample(self):
+		out = self.run_process("--begin 1 --sample 4 --sample-block-size 1000 --sample-stable 2 --seed 1", "test1.txt",
+			check_err=False)
+		expect = self.fix_type("col0decimal(4,2)notnullcol1tinyintnotnullcol2smallintnotnull")
+		self.assertEqual(out, expect)
+		self.assertTrue(self.err.startswith("Inspected "))
+		self.assertTrue(self.err.endswith(" sampled blocks"))
+
+	def testDateFormat(self):
+		out = self.run_process("--begin 1 --date-format %Y.%m --datetime-format '%Y.%m %H'", "test1.txt")
+		expect = self.fix_type("col0decimal(4,2)notnullcol1tinyintnotnullcol2smallintnotnull")
+		self.assertEqual(out, expect)
+
+	def testParallelProcess(self):
+		for num_process in [2, 4]:
+			for chunk_size in [10, 1000]:
+				flags = "--parallel-chunk-size {chunk_size} --parallelism {parallel} --parallel-mode process".format(
+					chunk_size=chunk_size, parallel=num_process)
+				out = self.run_process(flags, "test1.txt")
+				expect = self.fix_type("col0varchar(5)notnullcol1varchar(2)notnullcol2varchar(3)notnull")
+				self.assertEqual(out, expect)
+
+	def testStandalone(self):
+		# The client module is only needed for --serve and --connect
+		path = os.path.dirname(os.path.abspath(__file__))
+		tmp = tempfile.mkdtemp()
+		try:
+			shutil.copy(os.path.join(path, "whatismyschema.py"), tmp)
+			out = subprocess.check_output([sys.executable, os.path.join(tmp, "whatismyschema.py"),
+				os.path.join(path, "test1.txt")], cwd=tmp)
+			self.assertTrue(out.startswith(b"col0 varchar(5) NOT NULL"))
+		finally:
+			shutil.rmtree(tmp)
+
+	def start_server(self, sock_path):
+		path = os.path.dirname(os.path.abspath(__file__))
+		p = subprocess.Popen([sys.executable, os.path.join(path, "whatismyschema.py"),
+			"--serve", sock_path])
+
+		self.sock_path = sock_path
+		return p
+
+	def connect(self):
+		# The socket file exists before the server listens
+		deadline = time.time() + 30
+		while True:
+			client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				client.connect(self.sock_path)
+				return client
+			except socket.error:
+				client.close()
+				if time.time() > deadline:
+					raise
+				time.sleep(0.05)
+
+	def stop_server(self, p):
+		# Terminated servers also terminate their pool workers
+		if p.poll() is None:
+			p.terminate()
+			deadline = time.time() + 30
+			while p.poll() is None and time.time() < deadline:
+				time.sleep(0.05)
+		if p.poll() is None:
+			p.kill()
+			p.wait()
+
+	def testServeTerminate(self):
+		path = os.path.dirname(os.path.abspath(__file__))
+		tmp = tempfile.mkdtemp()
+		sock_path = os.path.join(tmp, "wims.sock")
+		p = self.start_server(sock_path)
+		try:
+			# SIGTERM while the job waits for more input
+			with closing(self.connect()) as client:
+				send_message(client, {"argv" : [], "cwd" : path, "tty" : False})
+				self.assertEqual(recv_message(client), {"stdin" : True})
+				client.sendall(b"1|a\n")
+
+				p.terminate()
+				deadline = time.time() + 30
+				while p.poll() is None and time.time() < deadline:
+					time.sleep(0.05)
+
+			self.assertEqual(p.poll(), 0)
+			self.assertFalse(os.path.exists(sock_path))
+		finally:
+			self.stop_server(p)
+			shutil.rmtree(tmp)
+
+	def testServeDirectories(self):
+		tmp = tempfile.mkdtemp()
+		sock_path = os.path.join(tmp, "wims.sock")
+		p = self.start_server(sock_path)
+		try:
+			# Same relative path, different files, through the warm pools
+			for (name, data, expect) in [
+					("a", "1|a\n" * 10, "tinyint"),
+					("b", "1000|bb\n" * 100000, "smallint"),
+					("a", "1|a\n" * 10, "tinyint")]:
+				cwd = os.path.join(tmp, name)
+				if not os.path.isdir(cwd):
+					os.mkdir(cwd)
+				with open(os.path.join(cwd, "d.txt"), 'w') as f:
+					f.write(data)
+
+				for argv in [["-P", "2", "--parallel-mode", "process", "d.txt"],
+						["--batch", "jsonl", "-P", "2", "d.txt"]]:
+					with closing(self.connect()) as client:
+						client.settimeout(60)
+						send_message(client, {"argv" : argv, "cwd" : cwd, "tty" : False})
+						self.assertEqual(recv_message(client), {"stdin" : False})
+						client.shutdown(socket.SHUT_WR)
+						response = recv_message(client)
+
+					self.assertEqual(response["status"], 0)
+					self.assertTrue(" {} ".format(expect) in response["stdout"] or
+						'"{}"'.format(expect) in response["stdout"])
+					if argv[0] == "--batch":
+						self.assertTrue('"file": "d.txt"' in response["stdout"])
+		finally:
+			self.stop_server(p)
+			shutil.rmtree(tmp)
+
 
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
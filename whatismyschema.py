@@ -11,11 +11,42 @@ from decimal import *
 from datetime import datetime
 import time # strpdate fallback for older Python versions
 import itertools
+import mmap
 try:
     from itertools import zip_longest as zip_longest
 except:
     from itertools import izip_longest as zip_longest
 from multiprocessing.pool import ThreadPool
+import re
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+import gzip
+import bz2
+try:
+	import lzma
+except ImportError:
+	lzma = None
+import threading
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+import hashlib
+try:
+	from hashlib import blake2b
+except ImportError:
+	blake2b = None
+import struct
+import math
 
 class MinMax(object):
 	__slots__ = "dmin", "dmax"
@@ -34,13 +65,137 @@ class MinMax(object):
 		return self.dmax is not None and self.dmin is not None
 
 	def merge(self, other):
+		if not other.exists():
+			return
 		self.push(other.dmin)
 		self.push(other.dmax)
 
-def check_int(s):
-	if s[0] in ('-', '+'):
-		return s[1:].isdigit()
-	return s.isdigit()
+	def __getstate__(self):
+		return (self.dmin, self.dmax)
+
+	def __setstate__(self, state):
+		(self.dmin, self.dmax) = state
+
+# Tokens used for parsing numbers in text and in bytes
+text_tokens = ("+", "-", ".", "0", "0123456789")
+bytes_tokens = (b"+", b"-", b".", b"0", b"0123456789")
+
+# Plain numbers in one pass: sign, leading zeros, further digits before
+# the dot, the dot and digits after it without trailing zeros
+number_pattern = u"([+-]?)(0*)([0-9]*)(\\.([0-9]*?)0*)?\\Z"
+number_match = re.compile(number_pattern).match
+number_match_bytes = re.compile(number_pattern.encode('ascii')).match
+
+# Portable str/bytes.isascii(), which needs Python 3.7
+non_ascii = re.compile(u"[^\\x00-\\x7f]").search
+non_ascii_bytes = re.compile(b"[^\\x00-\\x7f]").search
+
+# Longest integer within bigint: sign and 19 digits
+max_int_chars = 20
+
+def scan_number(attr):
+	"""
+	Scans a plain number <attr>. Returns (int_val, (len_pre, len_post)),
+	int_val being None for decimals and integers beyond bigint. None, if
+	<attr> is not a plain number.
+	"""
+	m = number_match_bytes(attr) if isinstance(attr, bytes) else number_match(attr)
+	if m is None:
+		return None
+
+	(sign, zeros, digits, dot, post) = m.groups()
+	int_val = None
+	if dot is None and (zeros or digits) and len(digits) <= 19:
+		int_val = int(attr)
+
+	return (int_val, (len(digits), 0 if post is None else len(post)))
+
+def scan_int(attr):
+	"""
+	int(<attr>) or None, if <attr> is no integer. Plain numbers too long
+	for bigint return None without the costly conversion.
+	"""
+	if len(attr) > max_int_chars:
+		scanned = scan_number(attr)
+		if scanned is not None:
+			return scanned[0]
+
+	try:
+		return int(attr)
+	except:
+		return None
+
+def decimal_digits(attr):
+	"""
+	Returns digits before and after the dot, without leading/trailing zeros,
+	if <attr> is a decimal. None, otherwise. <attr> can be text or bytes.
+	"""
+	scanned = scan_number(attr)
+	if scanned is not None:
+		return scanned[1]
+
+	# Unusual numbers, e.g. with whitespace or non-ASCII digits
+	valid = True
+
+	(plus, minus, decimal_sep, zero, digit_chars) = bytes_tokens if isinstance(attr, bytes) else text_tokens
+	data = attr
+
+	# remove leading sign
+	if data[:1] in (minus, plus):
+		data = data[1:]
+
+	# find dot
+	parts = data.split(decimal_sep, 1)
+	num_parts = len(parts)
+
+	len_pre = 0
+	len_post = 0
+
+	if num_parts == 1:
+		pre = parts[0]
+		post = parts[0][:0]
+	elif num_parts == 2:
+		pre = parts[0]
+		post = parts[1]
+		if len(post) > 0:
+			valid = (post[:1] in digit_chars)
+	else:
+		valid = False
+
+	if valid:
+		# remove leading zeros
+		pre = pre.lstrip(zero)
+
+		# remove trailing zeros
+		post = post.rstrip(zero)
+
+		# compute scale & precision
+		len_post = len(post)
+		len_pre = len(pre)
+
+
+		# empty 'pre' means implicit 0
+		if len_pre != 0:
+			try:
+				int(pre)
+			except:
+				valid = False
+
+		# decimal places must be integer
+		if len_post != 0:
+			try:
+				int(post)
+			except:
+				valid = False
+
+		#print("attr='{}' pre='{}' post='{}' decimal({}, {})".format(
+		#	attr, pre, post, len_pre, len_post))
+
+
+	if not valid:
+		return None
+
+	return (len_pre, len_post)
 
 class FormatTryAndError(object):
 	__slots__ = "formats", "valid"
@@ -51,6 +206,15 @@ class FormatTryAndError(object):
 	def match_format(self, attr, fmt):
 		return None
 
+	def maybe_match(self, attr):
+		"""
+		Cheap check whether any format could match <attr>
+		"""
+		return True
+
+	def formats_changed(self):
+		pass
+
 	def test(self, attr):
 		num_formats = len(self.formats)
 		if num_formats < 1:
@@ -62,6 +226,9 @@ class FormatTryAndError(object):
 				if val is None:
 					self.valid = False
 					return
+		elif not self.maybe_match(attr):
+			self.valid = False
+			return
 		else:
 			# Figure out format and eliminate invalid formats
 			new_formats = []
@@ -70,17 +237,158 @@ class FormatTryAndError(object):
 				if val is not None:
 					new_formats.append(fmt)
 
-			self.formats = new_formats
+			if len(new_formats) != num_formats:
+				self.formats = new_formats
+				self.formats_changed()
 			if len(new_formats) < 1:
 				self.valid = False
 
+	def matching(self, attr):
+		"""
+		Returns the formats matching <attr>, without eliminating any
+		"""
+		if len(self.formats) > 1 and not self.maybe_match(attr):
+			return ()
+		return tuple(fmt for fmt in self.formats
+			if self.match_format(attr, fmt) is not None)
+
+	def restrict(self, formats):
+		"""
+		Eliminates all formats not in <formats>
+		"""
+		new_formats = [fmt for fmt in self.formats if fmt in formats]
+		if len(new_formats) != len(self.formats):
+			self.formats = new_formats
+			self.formats_changed()
+		if len(new_formats) < 1:
+			self.valid = False
+
+	def merge(self, other):
+		# Only formats that matched on both sides survive
+		self.restrict(other.formats)
+
+	def __getstate__(self):
+		return (self.formats, self.valid)
+
+	def __setstate__(self, state):
+		(self.formats, self.valid) = state
+		self.formats_changed()
+
+
+# Permissive patterns for strptime() directives. They accept a superset of
+# what strptime() accepts, hence can only reject values early.
+strptime_patterns = {
+	'd': r"(?:\d{1,2}| \d)",
+	'f': r"\d{1,6}",
+	'H': r"\d{1,2}",
+	'I': r"\d{1,2}",
+	'j': r"\d{1,3}",
+	'm': r"\d{1,2}",
+	'M': r"\d{1,2}",
+	'S': r"\d{1,2}",
+	'U': r"\d{1,2}",
+	'w': r"\d",
+	'W': r"\d{1,2}",
+	'y': r"\d{2}",
+	'Y': r"\d{4}",
+	'%': r"%",
+}
+
+# Directives that can be validated by constructing a datetime directly
+datetime_fields = "YmdHMSf"
+
+# Compiled pre-filters, by format
+_format_matchers = {}
+
+# Directives captured by the pre-filter, by format. None, if the format
+# needs strptime() for validation
+_format_fields = {}
+
+def compile_format(fmt):
+	"""
+	Compiles a strptime() format into a regular expression matcher
+	"""
+	if fmt in _format_matchers:
+		return _format_matchers[fmt]
+
+	r = []
+	fields = []
+	i = 0
+	prev_field = False
+	while i < len(fmt):
+		c = fmt[i]
+		if c == '%' and i+1 < len(fmt):
+			i = i + 1
+			d = fmt[i]
+			if d in datetime_fields:
+				# Adjacent numbers are split by strptime()'s own rules
+				if fields is not None and (prev_field or d in fields):
+					fields = None
+				if fields is not None:
+					fields.append(d)
+				r.append("({})".format(strptime_patterns[d]))
+				prev_field = True
+			else:
+				# Unknown directives (names, time zones, ...) accept anything
+				r.append(strptime_patterns.get(d, r".*?"))
+				fields = None
+		elif c.isspace():
+			r.append(r"\s+")
+			prev_field = False
+		else:
+			r.append(re.escape(c))
+			prev_field = False
+		i = i + 1
+
+	matcher = re.compile("(?:{})\\Z".format("".join(r)), re.IGNORECASE).match
+	_format_matchers[fmt] = matcher
+	_format_fields[fmt] = fields
+	return matcher
+
+def make_datetime(fields, values):
+	"""
+	Constructs a datetime from captured directives the way strptime() does
+	"""
+	parts = {'Y': 1900, 'm': 1, 'd': 1, 'H': 0, 'M': 0, 'S': 0, 'f': 0}
+	for (d, val) in zip(fields, values):
+		if d == 'f':
+			val = val + "0" * (6 - len(val))
+		parts[d] = int(val)
+
+	return datetime(parts['Y'], parts['m'], parts['d'],
+		parts['H'], parts['M'], parts['S'], parts['f'])
+
 
 class DateTimeFormatTryAndError(FormatTryAndError):
 	def __init__(self, formats):
 		self.formats = formats
 		self.valid = True
+		self.formats_changed()
+
+	def formats_changed(self):
+		# Rejects values that none of the formats can match
+		key = tuple(self.formats)
+		if key not in _format_matchers:
+			_format_matchers[key] = re.compile("|".join(
+				"(?:{})".format(compile_format(fmt).__self__.pattern) for fmt in key),
+				re.IGNORECASE).match
+		self.prefilter = _format_matchers[key]
+
+	def maybe_match(self, attr):
+		return self.prefilter(attr) is not None
 
 	def match_format(self, attr, fmt):
+		m = compile_format(fmt)(attr)
+		if m is None:
+			return None
+
+		fields = _format_fields[fmt]
+		if fields is not None:
+			try:
+				return make_datetime(fields, m.groups())
+			except ValueError:
+				return None
+
 		try_fall_back = False
 
 		try:
@@ -96,6 +404,157 @@ class DateTimeFormatTryAndError(FormatTryAndError):
 			except ValueError:
 				return None
 
+def stable_hash(value):
+	"""
+	64 bit hash of bytes <value>. Unlike hash(), it is the same in every
+	process and run, hence sketches of workers and profiles can be merged.
+	"""
+	if blake2b is not None:
+		digest = blake2b(value, digest_size=8).digest()
+	else:
+		digest = hashlib.sha1(value).digest()
+	return struct.unpack("<Q", digest[:8])[0]
+
+class DistinctSketch(object):
+	"""
+	HyperLogLog estimate of the number of distinct values, using one byte
+	for each of the 2**precision registers. Merging sketches gives the
+	sketch of the union.
+	"""
+	__slots__ = "registers",
+
+	# Relative standard error is about 1.04 / sqrt(2**precision), i.e. 1.6%
+	precision = 12
+
+	def __init__(self):
+		self.registers = bytearray(1 << self.precision)
+
+	def push(self, value):
+		if not isinstance(value, bytes):
+			value = value.encode(Column.encoding)
+
+		h = stable_hash(value)
+		bits = 64 - self.precision
+		idx = h >> bits
+		# Position of the first set bit in the remaining bits
+		rank = bits + 1 - (h & ((1 << bits) - 1)).bit_length()
+		if rank > self.registers[idx]:
+			self.registers[idx] = rank
+
+	def push_values(self, values):
+		# Duplicates do not change the sketch
+		values = set(values)
+		if numpy is None or len(values) < Column.min_batch:
+			for value in values:
+				self.push(value)
+			return
+
+		encoding = Column.encoding
+		hashes = numpy.array([stable_hash(v if isinstance(v, bytes) else v.encode(encoding))
+			for v in values], dtype=numpy.uint64)
+
+		bits = 64 - self.precision
+		idx = (hashes >> numpy.uint64(bits)).astype(numpy.intp)
+		rest = hashes & numpy.uint64((1 << bits) - 1)
+
+		# Exponents equal bit lengths, as 'rest' fits into the mantissa
+		(mantissa, bit_length) = numpy.frexp(rest.astype(numpy.float64))
+		rank = (bits + 1 - bit_length).astype(numpy.uint8)
+
+		registers = numpy.frombuffer(self.registers, dtype=numpy.uint8)
+		numpy.maximum.at(registers, idx, rank)
+
+	def merge(self, other):
+		if numpy is not None:
+			registers = numpy.frombuffer(self.registers, dtype=numpy.uint8)
+			numpy.maximum(registers, numpy.frombuffer(other.registers, dtype=numpy.uint8),
+				out=registers)
+		else:
+			self.registers = bytearray(map(max, self.registers, other.registers))
+
+	def estimate(self):
+		m = len(self.registers)
+		alpha = 0.7213 / (1.0 + 1.079 / m)
+		est = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+		zeros = self.registers.count(b"\0")
+		if est <= 2.5 * m and zeros > 0:
+			# Few values, use linear counting
+			est = m * math.log(float(m) / zeros)
+
+		return int(round(est))
+
+	def __getstate__(self):
+		return bytes(self.registers)
+
+	def __setstate__(self, state):
+		self.registers = bytearray(state)
+
+class NumericSummary(object):
+	"""
+	Integer and decimal checks over a matrix of values (rows x columns),
+	given as NumPy bytes or unicode array. Per column, the outcome equals
+	checking each value on its own, provided the column is 'plain', i.e.
+	it consists only of [+-]?[0-9.]* values. Masked cells are ignored.
+	"""
+	__slots__ = "plain", "multi_dot", "int_elim", "int_exact", "int_min", "int_max", "pre_min", "pre_max", "post_min", "post_max"
+
+	def __init__(self, arr, mask=None):
+		(rows, cols) = arr.shape
+		arr = numpy.ascontiguousarray(arr)
+		if arr.dtype.kind == 'S':
+			width = arr.itemsize
+			chars = arr.view(numpy.uint8)
+		else:
+			width = arr.itemsize // 4
+			chars = arr.view(numpy.uint32)
+		chars = chars.reshape(rows, cols, width)
+		valid = numpy.ones((rows, cols), dtype=bool) if mask is None else mask
+
+		digit = (chars >= 48) & (chars <= 57)
+		dot = chars == 46
+		sign = (chars == 43) | (chars == 45)
+		padding = chars == 0
+
+		# Signs must be leading
+		plain = (digit | dot | sign | padding).all(axis=2) & ~sign[:, :, 1:].any(axis=2)
+		self.plain = (plain | ~valid).all(axis=0)
+		valid = valid & plain
+
+		lens = width - padding.sum(axis=2)
+		lead = sign[:, :, 0]
+		body_lens = lens - lead
+		dots = dot.sum(axis=2)
+
+		self.multi_dot = ((dots > 1) & valid).any(axis=0)
+
+		self.int_elim = (((dots > 0) | (body_lens == 0)) & valid).any(axis=0)
+		self.int_exact = ((body_lens > 18) & valid).any(axis=0)
+		is_int = valid & (dots == 0) & (body_lens > 0) & (body_lens <= 18)
+		ints = numpy.where(is_int, arr, arr.dtype.type("0")).astype(numpy.int64)
+		self.int_min = numpy.where(is_int, ints, numpy.iinfo(numpy.int64).max).min(axis=0)
+		self.int_max = numpy.where(is_int, ints, numpy.iinfo(numpy.int64).min).max(axis=0)
+
+		# Digits before the first dot without leading zeros, after the
+		# first dot without trailing zeros
+		pos = numpy.arange(width)
+		dot_pos = numpy.where(dots > 0, dot.argmax(axis=2), lens)
+		nonzero = digit & (chars != 48)
+
+		pre = nonzero & (pos < dot_pos[:, :, None])
+		first = numpy.where(pre.any(axis=2), pre.argmax(axis=2), dot_pos)
+		len_pre = dot_pos - first
+
+		post = nonzero & (pos > dot_pos[:, :, None])
+		last = numpy.where(post.any(axis=2), width - 1 - post[:, :, ::-1].argmax(axis=2), dot_pos)
+		len_post = last - dot_pos
+
+		(lo, hi) = (numpy.iinfo(numpy.int64).max, -1)
+		self.pre_min = numpy.where(valid, len_pre, lo).min(axis=0)
+		self.pre_max = numpy.where(valid, len_pre, hi).max(axis=0)
+		self.post_min = numpy.where(valid, len_post, lo).min(axis=0)
+		self.post_max = numpy.where(valid, len_post, hi).max(axis=0)
+
 class Column(object):
 	int_ranges = [
 			(-128, 127, "tinyint"),
@@ -104,7 +563,22 @@ class Column(object):
 			(-9223372036854775808, 9223372036854775807, "bigint")
 		]
 
-	__slots__ = "id", "name", "null_value", "num_nulls", "num_values", "int_minmax", "decpre_minmax", "decpost_minmax", "len_minmax", "guess_date", "guess_datetime"
+	# Persistent state
+	state_slots = "id", "name", "null_value", "num_nulls", "num_values", "int_minmax", "decpre_minmax", "decpost_minmax", "len_minmax", "guess_date", "guess_datetime", "cache_size", "cache_hits", "cache_misses", "binary", "eliminated", "distinct"
+
+	# 'push_value' is specialized to the remaining candidate types.
+	# In binary mode, 'push_native' is and 'push_value' decodes non-ASCII
+	# values first. With a distinct sketch, 'push_counted' is and
+	# 'push_value' adds the value to the sketch first.
+	# While a batch is checked, 'batch' holds its values and 'batch_start'
+	# the number of values before it.
+	__slots__ = state_slots + ("push_value", "push_native", "push_counted", "cache",
+		"batch", "batch_start", "batch_formats")
+
+	encoding = "utf8"
+
+	# Candidate types, whose elimination is recorded
+	candidates = "integer", "decimal", "date", "datetime"
 
 	def __init__(self, table, name):
 		self.id = len(table.columns)
@@ -113,7 +587,10 @@ class Column(object):
 		else:
 			self.name = name
 
+		self.binary = table.binary
 		self.null_value = table.parent_null_value
+		if self.binary:
+			self.null_value = self.null_value.encode(self.encoding)
 		self.num_nulls = 0
 		self.num_values = 0
 
@@ -122,16 +599,86 @@ class Column(object):
 		self.decpost_minmax = MinMax()
 		self.len_minmax = MinMax()
 
-		self.guess_date = DateTimeFormatTryAndError([
-				"%Y-%m-%d"
-			])
+		self.guess_date = DateTimeFormatTryAndError(list(table.date_formats))
+
+		self.guess_datetime= DateTimeFormatTryAndError(list(table.datetime_formats))
 
-		self.guess_datetime= DateTimeFormatTryAndError([
-				"%Y-%m-%d %H:%M:%S.%f",
-				"%Y-%m-%d %H:%M:%S"
-			])
+		self.cache_size = table.cache_size
+		self.cache_hits = 0
+		self.cache_misses = 0
+		self.cache = {} if self.cache_size > 0 else None
+
+		# Number of values seen when a candidate type got eliminated,
+		# including the eliminating value
+		self.eliminated = {}
+		self.batch = None
+
+		self.distinct = DistinctSketch() if table.distinct else None
+
+		self._update_state()
+
+	def _candidate_states(self):
+		return zip(self.candidates, (self.int_minmax, self.decpre_minmax,
+			self.guess_date, self.guess_datetime))
 
 	def push_attribute(self, attr, table):
+		self.push_value(attr)
+
+	def _update_state(self):
+		"""
+		Selects the push function for the remaining candidate types.
+		Candidates only ever get eliminated, so states move downwards
+		any -> (integer | decimal | temporal) -> varchar.
+		"""
+		for (name, state) in self._candidate_states():
+			if state is None and name not in self.eliminated:
+				if self.batch is None:
+					self.eliminated[name] = self.num_values
+				else:
+					self.eliminated[name] = self.batch_start + self._first_failure(name)
+
+		numeric = self.int_minmax is not None or self.decpre_minmax is not None
+		temporal = self.guess_date is not None or self.guess_datetime is not None
+
+		if temporal:
+			if self.cache is not None:
+				push = self._push_cached
+			else:
+				push = self._push_any if numeric else self._push_temporal
+		elif self.int_minmax is not None:
+			push = self._push_integer
+		elif self.decpre_minmax is not None:
+			push = self._push_cached if self.cache is not None else self._push_decimal
+		else:
+			push = self._push_varchar
+			self.cache = None
+
+		if self.binary:
+			self.push_native = push
+			self.push_value = self._push_bytes
+		else:
+			self.push_value = push
+
+		if self.distinct is not None:
+			self.push_counted = self.push_value
+			self.push_value = self._push_distinct
+
+	def _push_distinct(self, attr):
+		if attr != self.null_value:
+			self.distinct.push(attr)
+		self.push_counted(attr)
+
+	def _push_bytes(self, attr):
+		if not non_ascii_bytes(attr):
+			self.push_native(attr)
+		elif attr == self.null_value:
+			self.num_values += 1
+			self.num_nulls += 1
+		else:
+			# Character length and non-ASCII digits need text
+			self.push_native(attr.decode(self.encoding))
+
+	def _push_any(self, attr):
 		self.num_values += 1
 
 		if attr == self.null_value:
@@ -141,89 +688,365 @@ class Column(object):
 		self.len_minmax.push(len(attr))
 
 		if self.int_minmax is not None:
-			try:
-				self.int_minmax.push(int(attr))
-			except:
-				self.int_minmax = None
+			self._check_int(attr)
 
 		if self.decpre_minmax is not None:
-			valid = True
-
-			decimal_sep = "."
-			data = attr
-
-			# remove leading sign
-			if data[0] in ('-', '+'):
-				data = data[1:]
-
-			# find dot
-			parts = data.split(decimal_sep, 1)
-			num_parts = len(parts)
-
-			len_pre = 0
-			len_post = 0
-
-			if num_parts == 1:
-				pre = parts[0]
-				post = ""
-			elif num_parts == 2:
-				pre = parts[0]
-				post = parts[1]
-				if len(post) > 0:
-					valid = (post[0] in ('0','1','2','3','4','5','6','7','8','9'))
-			else:
-				valid = False
+			self._check_decimal(attr)
 
-			if valid:
-				# remove leading zeros
-				pre = pre.lstrip("0")
+		self._check_dates(attr)
 
-				# remove trailing zeros
-				post = post.rstrip("0")
+	def _classify(self, attr):
+		"""
+		Runs all checks of the remaining candidate types on <attr>, without
+		changing the column. Candidates only ever get eliminated, therefore
+		the outcome stays valid for every later state of this column.
+		"""
+		int_val = None
+		if self.int_minmax is not None:
+			int_val = scan_int(attr)
 
-				# compute scale & precision
-				len_post = len(post)
-				len_pre = len(pre)
+		digits = None
+		if self.decpre_minmax is not None:
+			digits = decimal_digits(attr)
 
+		if isinstance(attr, bytes) and (self.guess_date is not None or self.guess_datetime is not None):
+			attr = attr.decode(self.encoding)
 
-				# empty 'pre' means implicit 0
-				if len_pre != 0:
-					try:
-						int(pre)
-					except:
-						valid = False
+		dates = None
+		if self.guess_date is not None:
+			dates = self.guess_date.matching(attr)
 
-				# decimal places must be integer
-				if len_post != 0:
-					try:
-						int(post)
-					except:
-						valid = False
+		datetimes = None
+		if self.guess_datetime is not None:
+			datetimes = self.guess_datetime.matching(attr)
 
-				#print("attr='{}' pre='{}' post='{}' decimal({}, {})".format(
-				#	attr, pre, post, len_pre, len_post))
+		return (int_val, digits, dates, datetimes)
 
+	def _push_cached(self, attr):
+		self.num_values += 1
 
-			if valid:
-				self.decpre_minmax.push(len_pre)
-				self.decpost_minmax.push(len_post)
+		if attr == self.null_value:
+			self.num_nulls += 1
+			return
+
+		self.len_minmax.push(len(attr))
+		self._check_cached(attr)
+
+	def _check_cached(self, attr):
+		cache = self.cache
+		outcome = cache.get(attr)
+		if outcome is None:
+			self.cache_misses += 1
+			outcome = self._classify(attr)
+
+			if len(cache) >= self.cache_size:
+				if self.cache_hits < self.cache_misses:
+					# Values hardly repeat, stop caching
+					self.cache = None
+					self._update_state()
+				else:
+					cache.clear()
+			if self.cache is not None:
+				cache[attr] = outcome
+		else:
+			self.cache_hits += 1
 
-				# print("DECIMAL '{attr}': {a} {b}\n".format(attr=attr, a=precision, b=scale))
+		(int_val, digits, dates, datetimes) = outcome
+		changed = False
 
-			if not valid:
+		if self.int_minmax is not None:
+			if int_val is None:
+				self.int_minmax = None
+				changed = True
+			else:
+				self.int_minmax.push(int_val)
+
+		if self.decpre_minmax is not None:
+			if digits is None:
 				self.decpre_minmax = None
 				self.decpost_minmax = None
+				changed = True
+			else:
+				self.decpre_minmax.push(digits[0])
+				self.decpost_minmax.push(digits[1])
+
+		if self.guess_date is not None:
+			self.guess_date.restrict(dates)
+			if not self.guess_date.valid:
+				self.guess_date = None
+				changed = True
+
+		if self.guess_datetime is not None:
+			self.guess_datetime.restrict(datetimes)
+			if not self.guess_datetime.valid:
+				self.guess_datetime = None
+				changed = True
+
+		if changed:
+			self._update_state()
+
+	def _push_integer(self, attr):
+		self.num_values += 1
+
+		if attr == self.null_value:
+			self.num_nulls += 1
+			return
+
+		self.len_minmax.push(len(attr))
+
+		int_val = scan_int(attr)
+		if int_val is not None:
+			self.int_minmax.push(int_val)
+		else:
+			self.int_minmax = None
+			if self.decpre_minmax is not None:
+				self._check_decimal(attr)
+			self._update_state()
+			return
+
+		if self.decpre_minmax is not None:
+			(plus, minus, dot, zero, digit_chars) = bytes_tokens if isinstance(attr, bytes) else text_tokens
+			digits = attr[1:] if attr[:1] in (minus, plus) else attr
+			if digits.isdigit():
+				# Integers are decimals without scale
+				self.decpre_minmax.push(len(digits.lstrip(zero)))
+				self.decpost_minmax.push(0)
+			else:
+				self._check_decimal(attr)
+
+	def _push_decimal(self, attr):
+		self.num_values += 1
+
+		if attr == self.null_value:
+			self.num_nulls += 1
+			return
+
+		self.len_minmax.push(len(attr))
+		self._check_decimal(attr)
+
+	def _push_temporal(self, attr):
+		self.num_values += 1
+
+		if attr == self.null_value:
+			self.num_nulls += 1
+			return
+
+		self.len_minmax.push(len(attr))
+		self._check_dates(attr)
+
+	def _push_varchar(self, attr):
+		self.num_values += 1
+
+		if attr == self.null_value:
+			self.num_nulls += 1
+			return
+
+		self.len_minmax.push(len(attr))
+
+	# Matches any character that cannot be part of a plain decimal number
+	non_numeric = re.compile(u"[^0-9.+\\-]")
+	non_numeric_bytes = re.compile(b"[^0-9.+\\-]")
+
+	# Below this batch size, converting to arrays does not pay off
+	min_batch = 64
+
+	def push_values(self, values):
+		"""
+		Pushes a batch of attributes. With NumPy available, length and
+		numeric checks run over the whole batch, producing the same MinMax
+		results as push_attribute() would.
+		"""
+		if numpy is None or len(values) < self.min_batch:
+			for attr in values:
+				self.push_value(attr)
+			return
+
+		null_value = self.null_value
+		vals = [v for v in values if v != null_value]
+
+		self._begin_batch(values, self.num_values)
+		self.num_values += len(values)
+		self.num_nulls += len(values) - len(vals)
+
+		if len(vals) == 0:
+			self._end_batch()
+			return
+
+		if self.distinct is not None:
+			self.distinct.push_values(vals)
+
+		numeric = self.int_minmax is not None or self.decpre_minmax is not None
+
+		if isinstance(vals[0], bytes):
+			joined = b"".join(vals)
+			if not non_ascii_bytes(joined):
+				non_numeric = self.non_numeric_bytes
+			else:
+				# Character lengths need text
+				vals = [v.decode(self.encoding) for v in vals]
+				joined = "".join(vals)
+				non_numeric = self.non_numeric
+		else:
+			joined = "".join(vals) if numeric else ""
+			non_numeric = self.non_numeric
+
+		if numeric and not non_numeric.search(joined):
+			# Plain ASCII numbers, hence bytes have the same length
+			arr = numpy.array(vals, dtype='S')
+
+			lens = numpy.char.str_len(arr)
+			self.len_minmax.push(int(lens.min()))
+			self.len_minmax.push(int(lens.max()))
+
+			summary = NumericSummary(arr.reshape(-1, 1))
+			if summary.plain[0]:
+				if not self._push_numeric_summary(summary, 0):
+					self._check_ints(vals)
+				numeric = False
+		else:
+			lens = list(map(len, vals))
+			self.len_minmax.push(min(lens))
+			self.len_minmax.push(max(lens))
+
+		self._check_values(vals, numeric)
+		self._update_state()
+		self._end_batch()
+
+	def _begin_batch(self, values, num_before):
+		"""
+		Remembers the batch <values>, such that eliminations within it
+		are counted per value
+		"""
+		self.batch = values
+		self.batch_start = num_before
+		# Formats are replaced, never changed in place
+		self.batch_formats = (
+			self.guess_date.formats if self.guess_date is not None else None,
+			self.guess_datetime.formats if self.guess_datetime is not None else None)
+
+	def _end_batch(self):
+		self.batch = None
+		self.batch_formats = None
+
+	def _first_failure(self, name):
+		"""
+		Position of the first value of the current batch ruling out
+		candidate <name>, counting from 1 and including NULLs
+		"""
+		if name == "integer":
+			fails = lambda attr: scan_int(attr) is None
+		elif name == "decimal":
+			fails = lambda attr: decimal_digits(attr) is None
+		else:
+			guess = DateTimeFormatTryAndError(list(
+				self.batch_formats[0 if name == "date" else 1]))
+			def fails(attr):
+				guess.test(attr)
+				return not guess.valid
+
+		for (pos, attr) in enumerate(self.batch):
+			if attr == self.null_value:
+				continue
+			if isinstance(attr, bytes) and (name in ("date", "datetime") or non_ascii_bytes(attr)):
+				attr = attr.decode(self.encoding)
+			if fails(attr):
+				return pos + 1
+
+		return len(self.batch)
+
+	def _check_values(self, vals, numeric):
+		"""
+		Exact per-value checks of the remaining candidates, numeric ones
+		only if <numeric>
+		"""
+		if numeric:
+			# Unusual values, use exact per-value checks
+			for attr in vals:
+				if self.int_minmax is not None:
+					self._check_int(attr)
+				if self.decpre_minmax is not None:
+					self._check_decimal(attr)
+				if self.int_minmax is None and self.decpre_minmax is None:
+					break
+
+		if self.guess_date is not None or self.guess_datetime is not None:
+			for attr in vals:
+				if self.cache is not None:
+					# Re-applying numeric outcomes does not change anything
+					self._check_cached(attr)
+				else:
+					self._check_dates(attr)
+				if self.guess_date is None and self.guess_datetime is None:
+					break
+
+	def _check_ints(self, vals):
+		for attr in vals:
+			self._check_int(attr)
+			if self.int_minmax is None:
+				break
+
+	def _push_numeric_summary(self, summary, idx):
+		"""
+		Applies the outcome of column <idx> of a plain NumericSummary.
+		Returns False, if integers are too long and need exact checks.
+		"""
+		if summary.multi_dot[idx]:
+			self.int_minmax = None
+			self.decpre_minmax = None
+			self.decpost_minmax = None
+			return True
+
+		if self.decpre_minmax is not None:
+			self.decpre_minmax.push(int(summary.pre_min[idx]))
+			self.decpre_minmax.push(int(summary.pre_max[idx]))
+			self.decpost_minmax.push(int(summary.post_min[idx]))
+			self.decpost_minmax.push(int(summary.post_max[idx]))
+
+		if self.int_minmax is not None:
+			if summary.int_elim[idx]:
+				self.int_minmax = None
+			elif summary.int_exact[idx]:
+				return False
+			else:
+				self.int_minmax.push(int(summary.int_min[idx]))
+				self.int_minmax.push(int(summary.int_max[idx]))
+
+		return True
+
+	def _check_int(self, attr):
+		int_val = scan_int(attr)
+		if int_val is not None:
+			self.int_minmax.push(int_val)
+		else:
+			self.int_minmax = None
+			self._update_state()
+
+	def _check_decimal(self, attr):
+		digits = decimal_digits(attr)
+
+		if digits is not None:
+			self.decpre_minmax.push(digits[0])
+			self.decpost_minmax.push(digits[1])
+		else:
+			self.decpre_minmax = None
+			self.decpost_minmax = None
+			self._update_state()
+
+	def _check_dates(self, attr):
+		if isinstance(attr, bytes):
+			attr = attr.decode(self.encoding)
 
 		if self.guess_date is not None:
 			self.guess_date.test(attr)
 			if not self.guess_date.valid:
 				self.guess_date = None
+				self._update_state()
 
 		if self.guess_datetime is not None:
 			self.guess_datetime.test(attr)
 			if not self.guess_datetime.valid:
 				self.guess_datetime = None
-
+				self._update_state()
 
 	def determine_type(self):
 		r = []
@@ -266,6 +1089,14 @@ class Column(object):
 	def merge(self, other):
 		assert(other.id == self.id)
 
+		# Values seen per side, unless a candidate got eliminated earlier
+		checked = dict((name, self.eliminated.get(name, self.num_values) +
+				other.eliminated.get(name, other.num_values))
+			for name in self.candidates)
+
+		self.num_values += other.num_values
+		self.num_nulls += other.num_nulls
+
 		if self.int_minmax is not None and other.int_minmax is not None:
 			self.int_minmax.merge(other.int_minmax)
 		else:
@@ -286,15 +1117,155 @@ class Column(object):
 		else:
 			self.len_minmax = None
 
-		if other.guess_date is None:
+		if self.guess_date is not None and other.guess_date is not None:
+			self.guess_date.merge(other.guess_date)
+			if not self.guess_date.valid:
+				self.guess_date = None
+		else:
 			self.guess_date = None
 
-		if other.guess_datetime is None:
-			self.guess_datetime
+		if self.guess_datetime is not None and other.guess_datetime is not None:
+			self.guess_datetime.merge(other.guess_datetime)
+			if not self.guess_datetime.valid:
+				self.guess_datetime = None
+		else:
+			self.guess_datetime = None
+
+		if self.distinct is not None and other.distinct is not None:
+			self.distinct.merge(other.distinct)
+		else:
+			self.distinct = None
+
+		# Merging only eliminates candidates, so cached outcomes stay valid
+		self.cache_hits += other.cache_hits
+		self.cache_misses += other.cache_misses
+
+		for (name, state) in self._candidate_states():
+			if state is None:
+				self.eliminated[name] = checked[name]
+
+		self._update_state()
+
+	def __getstate__(self):
+		return tuple(getattr(self, slot) for slot in self.state_slots)
+
+	def __setstate__(self, state):
+		for (slot, value) in zip(self.state_slots, state):
+			setattr(self, slot, value)
+
+		# The cache itself is not shipped
+		self.cache = {} if self.cache_size > 0 else None
+		self.batch = None
+		self._update_state()
+
+
+def split_quoted(record, sep, quote):
+	"""
+	Splits <record> at <sep> like str.split(), except within fields
+	enclosed in <quote>. Quotes are removed and doubled quotes inside
+	quoted fields are unescaped (RFC 4180).
+	"""
+	fields = []
+	empty = record[:0]
+	len_sep = len(sep)
+	n = len(record)
+	i = 0
+
+	while True:
+		field = empty
+		if record.startswith(quote, i):
+			# quoted part
+			parts = []
+			j = i + 1
+			while True:
+				k = record.find(quote, j)
+				if k < 0:
+					# unterminated, take the rest
+					parts.append(record[j:])
+					j = n
+					break
+
+				parts.append(record[j:k])
+				if record.startswith(quote, k+1):
+					parts.append(quote)
+					j = k + 2
+				else:
+					j = k + 1
+					break
 
+			field = empty.join(parts)
+			i = j
+
+		k = record.find(sep, i)
+		if k < 0:
+			fields.append(field + record[i:])
+			return fields
+
+		fields.append(field + record[i:k])
+		i = k + len_sep
+
+def in_quotes(line, sep, quote, quoted=False):
+	"""
+	Whether <line> ends within a quoted field, given whether it starts
+	within one. As with split_quoted() and the csv module, quotes only open
+	fields at their start and are literal elsewhere.
+	"""
+	if quote not in line:
+		return quoted
+
+	(len_sep, len_quote) = (len(sep), len(quote))
+	i = 0
+	if not quoted and line.startswith(quote):
+		(quoted, i) = (True, len_quote)
+
+	while True:
+		if quoted:
+			k = line.find(quote, i)
+			if k < 0:
+				return True
+			if line.startswith(quote, k + len_quote):
+				# doubled quote
+				i = k + 2*len_quote
+				continue
+			(quoted, i) = (False, k + len_quote)
+
+		k = line.find(sep, i)
+		if k < 0:
+			return False
+		i = k + len_sep
+		if line.startswith(quote, i):
+			(quoted, i) = (True, i + len_quote)
+
+def lines_in_quotes(lines, sep, quote):
+	"""
+	Whether the records in <lines> end within a quoted field
+	"""
+	quoted = False
+	for line in lines:
+		quoted = in_quotes(line, sep, quote, quoted)
+	return quoted
 
 class Table:
-	__slots__ = "seperator", "columns", "line_number", "parent_null_value"
+	default_date_formats = [
+		"%Y-%m-%d"
+	]
+
+	default_datetime_formats = [
+		"%Y-%m-%d %H:%M:%S.%f",
+		"%Y-%m-%d %H:%M:%S"
+	]
+
+	# Default number of cached classifications per column
+	default_cache_size = 4096
+
+	# Batches of rows with at least this many columns are checked as one
+	# matrix, instead of column by column
+	matrix_width = 32
+
+	# Maximal number of characters per matrix
+	matrix_chars = 16*1024*1024
+
+	__slots__ = "seperator", "columns", "line_number", "parent_null_value", "date_formats", "datetime_formats", "cache_size", "binary", "quote", "pending", "distinct"
 	def __init__(self):
 		self.seperator = "|"
 
@@ -303,36 +1274,240 @@ class Table:
 
 		self.parent_null_value = ""
 
+		self.date_formats = list(self.default_date_formats)
+		self.datetime_formats = list(self.default_datetime_formats)
+
+		self.cache_size = self.default_cache_size
+
+		# Lines are given as bytes
+		self.binary = False
+
+		# Quote character, None disables quoting
+		self.quote = None
+
+		# Lines of a record that continues in the next line
+		self.pending = None
+
+		# Columns estimate their number of distinct values
+		self.distinct = False
+
+	def _tokens(self):
+		if self.binary:
+			return (self.seperator.encode(Column.encoding),
+				None if self.quote is None else self.quote.encode(Column.encoding),
+				b'\n', b'\r')
+		return (self.seperator, self.quote, '\n', '\r')
+
+	def _has_quotes(self, lines):
+		if self.pending is not None:
+			return True
+		(sep, quote, nl, cr) = self._tokens()
+		return quote in nl.join(lines)
+
+	def _push_quoted(self, lines):
+		"""
+		Assembles records spanning multiple lines and splits them respecting
+		quotes
+		"""
+		(sep, quote, nl, cr) = self._tokens()
+
+		pending = self.pending
+		for line in lines:
+			line = line.rstrip(nl)
+			quoted = in_quotes(line, sep, quote, pending is not None)
+
+			if pending is not None:
+				pending.append(line)
+				if quoted:
+					continue
+
+				line = nl.join(pending)
+				pending = None
+			elif quoted:
+				pending = [line]
+				continue
+
+			self.push_attrs(split_quoted(line.rstrip(cr), sep, quote))
+
+		self.pending = pending
+
+	def flush(self):
+		"""
+		Pushes a last record with an unterminated quote
+		"""
+		if self.pending is not None:
+			(sep, quote, nl, cr) = self._tokens()
+			record = nl.join(self.pending)
+			self.pending = None
+			self.push_attrs(split_quoted(record.rstrip(cr), sep, quote))
+
 	def push_line(self, line):
-		attrs = line.rstrip('\n').rstrip('\r').split(self.seperator)
+		if self.quote is not None and self._has_quotes([line]):
+			self._push_quoted([line])
+			return
+
+		if self.binary:
+			self.push_attrs(line.rstrip(b'\n').rstrip(b'\r').split(
+				self.seperator.encode(Column.encoding)))
+		else:
+			self.push_attrs(line.rstrip('\n').rstrip('\r').split(self.seperator))
+
+	def _add_columns(self, num):
+		for r in range(0, num):
+			c = Column(self, None)
+
+			# Add NULLs because these columns are new
+			# Hence before that they are considered missing values
+			c.num_nulls = self.line_number
+			c.num_values = self.line_number
 
+			self.columns.append(c)
+
+	def push_attrs(self, attrs):
 		num_attrs = len(attrs)
 		num_cols = len(self.columns)
 
-		if num_attrs != num_cols:		
+		if num_attrs != num_cols:
 			diff = num_attrs - num_cols
 			if num_attrs > num_cols:
-				for r in range(0, diff):
-					c = Column(self, None)
-
-					# Add NULLs because these columns are new
-					# Hence before that they are considered missing values
-					c.num_nulls = self.line_number
-					c.num_values = self.line_number
-
-					self.columns.append(c)
+				self._add_columns(diff)
 			else:
 				assert(num_attrs < num_cols)
-				for r in range(0, diff):
+				for r in range(0, -diff):
 					# Append safe NULL values
 					c = self.columns[r+num_attrs]
 					attrs.append(c.null_value)
 
 		for (attr, col) in zip(attrs, self.columns):
-			col.push_attribute(attr, self)
+			col.push_value(attr)
 
 		self.line_number = self.line_number + 1
 
+	def push_lines(self, lines):
+		if self.quote is not None and self._has_quotes(lines):
+			self._push_quoted(lines)
+			return
+
+		num_lines = len(lines)
+		if self.binary:
+			(sep, nl, cr) = (self.seperator.encode(Column.encoding), b'\n', b'\r')
+		else:
+			(sep, nl, cr) = (self.seperator, '\n', '\r')
+
+		if numpy is None or num_lines == 0 or (num_lines < Column.min_batch and
+				lines[0].count(sep) + 1 < self.matrix_width):
+			push_line = self.push_line
+			for line in lines:
+				push_line(line)
+			return
+
+		text = sep.join(lines)
+		if nl in text or cr in text:
+			text = sep.join([line.rstrip(nl).rstrip(cr) for line in lines])
+
+		widths = set([line.count(sep) for line in lines])
+		width = widths.pop() + 1
+		if len(widths) != 0 or width < len(self.columns):
+			# Ragged rows, pad row by row
+			for line in lines:
+				self.push_line(line)
+			return
+
+		self._add_columns(width - len(self.columns))
+
+		flat = text.split(sep)
+		if width < self.matrix_width or not self._push_matrix(flat, text, width):
+			# Transpose into per-column batches
+			for (idx, col) in enumerate(self.columns):
+				col.push_values(flat[idx::width])
+
+		self.line_number = self.line_number + num_lines
+
+	def _push_matrix(self, flat, text, width):
+		"""
+		Pushes the values <flat> of rows with <width> columns as matrices
+		of at most 'matrix_chars' characters. Returns False, if the values
+		do not fit into arrays.
+		"""
+		if self.binary:
+			if non_ascii_bytes(text) or b"\0" in text:
+				# Character lengths need text
+				return False
+			dtype = 'S'
+		else:
+			if "\0" in text:
+				return False
+			dtype = 'U' if non_ascii(text) else 'S'
+
+		longest = max(1, max(map(len, flat)))
+		step = self.matrix_chars // (longest * width)
+		if step == 0:
+			return False
+
+		num_rows = len(flat) // width
+		for start in range(0, num_rows, step):
+			values = flat[start*width:(start+step)*width]
+			self._push_block(numpy.array(values, dtype=dtype).reshape(-1, width), values)
+
+		return True
+
+	def _push_block(self, arr, values):
+		"""
+		Computes NULLs, lengths and numeric checks of all columns at once,
+		then folds the outcome into each column. Only temporal candidates
+		and unusual numbers are checked value by value.
+		"""
+		(num_rows, width) = arr.shape
+		null_value = self.columns[0].null_value
+		if arr.dtype.kind == 'S' and not isinstance(null_value, bytes):
+			null_value = null_value.encode(Column.encoding)
+
+		nulls = arr == null_value
+		num_nulls = nulls.sum(axis=0)
+		lens = numpy.char.str_len(arr)
+		len_min = numpy.where(nulls, numpy.iinfo(numpy.int64).max, lens).min(axis=0)
+		len_max = numpy.where(nulls, -1, lens).max(axis=0)
+
+		numeric_cols = [idx for (idx, col) in enumerate(self.columns)
+			if col.int_minmax is not None or col.decpre_minmax is not None]
+		if len(numeric_cols) > 0:
+			summary = NumericSummary(arr[:, numeric_cols], ~nulls[:, numeric_cols])
+		numeric_idx = dict((idx, i) for (i, idx) in enumerate(numeric_cols))
+
+		for (idx, col) in enumerate(self.columns):
+			col.num_values += num_rows
+			col.num_nulls += int(num_nulls[idx])
+			if num_nulls[idx] == num_rows:
+				continue
+
+			col.len_minmax.push(int(len_min[idx]))
+			col.len_minmax.push(int(len_max[idx]))
+
+			vals = None
+			if col.distinct is not None:
+				vals = [v for v in values[idx::width] if v != col.null_value]
+				col.distinct.push_values(vals)
+
+			numeric = idx in numeric_idx
+			if not numeric and col.guess_date is None and col.guess_datetime is None:
+				continue
+			col._begin_batch(values[idx::width], col.num_values - num_rows)
+
+			if numeric and summary.plain[numeric_idx[idx]]:
+				if not col._push_numeric_summary(summary, numeric_idx[idx]):
+					if vals is None:
+						vals = [v for v in values[idx::width] if v != col.null_value]
+					col._check_ints(vals)
+				numeric = False
+
+			if numeric or col.guess_date is not None or col.guess_datetime is not None:
+				if vals is None:
+					vals = [v for v in values[idx::width] if v != col.null_value]
+				col._check_values(vals, numeric)
+
+			col._update_state()
+			col._end_batch()
+
 	def push(self, x):
 		self.push_line(x)
 
@@ -364,17 +1539,239 @@ class Table:
 			if scol is not None:
 				if ocol is not None:
 					scol.merge(ocol)
+				else:
+					# Column is missing on the other side, hence NULL there
+					scol.num_values += other.line_number
+					scol.num_nulls += other.line_number
 				new_cols.append(scol)
 			else:
+				ocol.num_values += self.line_number
+				ocol.num_nulls += self.line_number
 				new_cols.append(ocol)
 
 		self.columns = new_cols
+		self.line_number += other.line_number
+
+	def __getstate__(self):
+		return tuple(getattr(self, slot) for slot in self.__slots__)
+
+	def __setstate__(self, state):
+		for (slot, value) in zip(self.__slots__, state):
+			setattr(self, slot, value)
+
+def parse_type(tpe):
+	"""
+	Splits SQL type <tpe> as returned by Column.determine_type() into its
+	name and arguments
+	"""
+	m = re.match(r"(\w+)(?:\((\d+)(?:,(\d+))?\))?\Z", tpe.lower().replace(" ", ""))
+	if m is None or m.group(1) not in validated_types:
+		raise ValueError("Unknown type '{}'".format(tpe))
+
+	(name, arg1, arg2) = m.groups()
+	if (arg1 is not None) != (name in ("decimal", "varchar")) or (arg2 is not None) != (name == "decimal"):
+		raise ValueError("Unknown type '{}'".format(tpe))
+
+	return (name, None if arg1 is None else int(arg1), None if arg2 is None else int(arg2))
+
+int_type_ranges = dict((name, (lo, hi)) for (lo, hi, name) in Column.int_ranges)
+validated_types = set(int_type_ranges) | set(["decimal", "date", "datetime", "varchar", "boolean"])
+
+def compile_checker(tpe, nullable, null_value, formats):
+	"""
+	Returns a function telling, whether a value fits the parsed type <tpe>.
+	Dates and datetimes need a common format out of <formats>, as in
+	inference, so checkers of these types narrow it down while checking.
+	"""
+	(name, arg1, arg2) = tpe
+
+	if name in int_type_ranges:
+		(lo, hi) = int_type_ranges[name]
+		def check(attr):
+			val = scan_int(attr)
+			return val is not None and lo <= val <= hi
+	elif name == "decimal":
+		(max_pre, max_post) = (arg1 - arg2, arg2)
+		def check(attr):
+			digits = decimal_digits(attr)
+			return digits is not None and digits[0] <= max_pre and digits[1] <= max_post
+	elif name in ("date", "datetime"):
+		guess = DateTimeFormatTryAndError(list(formats))
+		def check(attr):
+			# A mismatch is a violation, but keeps the formats seen so far
+			formats = guess.matching(attr)
+			if not formats:
+				return False
+			guess.restrict(formats)
+			return True
+	elif name == "varchar":
+		def check(attr):
+			return len(attr) <= arg1
+	else:
+		# Boolean columns only hold NULLs
+		def check(attr):
+			return False
+
+	def check_null(attr):
+		if attr == null_value:
+			return nullable
+		return check(attr)
+
+	return check_null
+
+class Validator(Table):
+	"""
+	Checks rows against a given schema, instead of inferring one. Morsels
+	are pushed into a probe table, whose columns only check their declared
+	type. Once a morsel does not fit, rows are checked one by one to find
+	the violations. Stops after <max_violations> violations, 0 means no
+	limit.
+	"""
+	__slots__ = "schema", "types", "probe", "checkers", "max_violations", "violations", "path"
+
+	def __init__(self, schema, max_violations):
+		Table.__init__(self)
+		self.schema = schema
+		self.types = [parse_type(tpe) for (name, tpe, nullable) in schema]
+		self.probe = None
+		self.checkers = None
+		self.max_violations = max_violations
+		self.violations = []
+		self.path = None
+
+	def _formats(self, tpe):
+		return self.date_formats if tpe[0] == "date" else self.datetime_formats
+
+	def compile(self):
+		"""
+		Sets up checking, after settings have been applied
+		"""
+		probe = Table()
+		(probe.seperator, probe.parent_null_value, probe.cache_size) = (
+			self.seperator, self.parent_null_value, self.cache_size)
+		probe.date_formats = list(self.date_formats)
+		probe.datetime_formats = list(self.datetime_formats)
+
+		for ((name, tpe, nullable), (type_name, arg1, arg2)) in zip(self.schema, self.types):
+			col = Column(probe, name)
+			if type_name not in int_type_ranges:
+				col.int_minmax = None
+			if type_name != "decimal":
+				col.decpre_minmax = None
+				col.decpost_minmax = None
+			if type_name != "date":
+				col.guess_date = None
+			if type_name != "datetime":
+				col.guess_datetime = None
+			col._update_state()
+			probe.columns.append(col)
+
+		self.probe = probe
+		self.checkers = None
+		if self.quote is not None:
+			# Records may span morsels
+			self._compile_checkers([self._formats(tpe) for tpe in self.types])
+
+	def _compile_checkers(self, formats):
+		self.checkers = [compile_checker(tpe, nullable, self.parent_null_value, fmts)
+			for ((name, t, nullable), tpe, fmts) in zip(self.schema, self.types, formats)]
+
+	def _fits(self):
+		"""
+		Whether all rows pushed into the probe fit the schema
+		"""
+		if len(self.probe.columns) > len(self.schema):
+			return False
+
+		for (col, (name, tpe, nullable), (type_name, arg1, arg2)) in zip(
+				self.probe.columns, self.schema, self.types):
+			if not nullable and col.num_nulls > 0:
+				return False
+
+			if type_name in int_type_ranges:
+				(lo, hi) = int_type_ranges[type_name]
+				mm = col.int_minmax
+				if mm is None or (mm.dmax is not None and (mm.dmin < lo or mm.dmax > hi)):
+					return False
+			elif type_name == "decimal":
+				if col.decpre_minmax is None or (col.decpre_minmax.dmax is not None and
+						(col.decpre_minmax.dmax > arg1 - arg2 or col.decpost_minmax.dmax > arg2)):
+					return False
+			elif type_name == "date":
+				if col.guess_date is None:
+					return False
+			elif type_name == "datetime":
+				if col.guess_datetime is None:
+					return False
+			elif type_name == "varchar":
+				if col.len_minmax.dmax is not None and col.len_minmax.dmax > arg1:
+					return False
+			elif col.num_nulls != col.num_values:
+				return False
+
+		return True
+
+	def full(self):
+		return self.max_violations > 0 and len(self.violations) >= self.max_violations
+
+	def _violation(self, idx, attr):
+		if not self.full():
+			self.violations.append((self.path, self.line_number, idx, attr))
+
+	def push_attrs(self, attrs):
+		if self.full():
+			return
+		self.line_number = self.line_number + 1
+
+		num_cols = len(self.checkers)
+		for (idx, (attr, check)) in enumerate(zip(attrs, self.checkers)):
+			if not check(attr):
+				self._violation(idx, attr)
+
+		if len(attrs) > num_cols:
+			self._violation(num_cols, attrs[num_cols])
+		for idx in range(len(attrs), num_cols):
+			# Missing values are NULLs
+			if not self.checkers[idx](self.parent_null_value):
+				self._violation(idx, self.parent_null_value)
+
+	def push_lines(self, lines):
+		if self.checkers is None:
+			# Formats common to all rows so far
+			formats = []
+			for (col, tpe) in zip(self.probe.columns, self.types):
+				guess = col.guess_date if tpe[0] == "date" else col.guess_datetime
+				formats.append(list(guess.formats) if guess is not None else None)
+
+			num_lines = self.probe.line_number
+			self.probe.push_lines(lines)
+			if self._fits():
+				self.line_number += self.probe.line_number - num_lines
+				return
+
+			self._compile_checkers(formats)
+
+		for line in lines:
+			self.push_line(line)
+
+def quote_tokens(args):
+	"""
+	Separator and quote of <args> as found in lines, i.e. bytes with
+	--binary
+	"""
+	if not args.binary:
+		return (args.seperator, args.quote)
+	return (args.seperator.encode(Column.encoding),
+		None if args.quote is None else args.quote.encode(Column.encoding))
 
 class FileDriver:
-	__slots__ = "mutex", "file", "chunk_size", "begin", "count", "done"
-	def __init__(self, file, args):
+	__slots__ = "mutex", "file", "path", "chunk_size", "begin", "count", "done", "binary", "sep", "quote"
+	def __init__(self, file, args, path=None):
 		self.mutex = multiprocessing.Lock()
 		self.file = file
+		self.path = path
+		self.binary = args.binary
+		(self.sep, self.quote) = quote_tokens(args)
 		assert(args.chunk_size >= 1)
 		self.chunk_size = args.chunk_size
 		self.begin = args.begin
@@ -390,60 +1787,863 @@ class FileDriver:
 			self.count = self.count + 1
 		return True
 
-	def nextTuple(self):
-		if self.done:
-			return None
+	def nextTuple(self):
+		if self.done:
+			return None
+
+		success = self._skip_begin()
+		if not success:
+			return None
+
+		l = self.file.readline()
+		if not l:
+			self.done = True
+			return None
+
+		self.count = self.count + 1
+		return l
+
+	def progress(self):
+		"""
+		Rows and bytes read so far and total bytes, None if unknown
+		"""
+		return (self.count, None, None)
+
+	def nextMorsel(self):
+		with self.mutex:
+			r = []
+
+			if self.done:
+				return None
+
+			success = self._skip_begin()
+			if not success:
+				return None
+
+			for i in range(0, self.chunk_size):
+				l = self.file.readline()
+				if not l:
+					self.done = True
+					break
+				self.count = self.count + 1
+
+				r.append(l)
+
+			# Do not cut quoted fields spanning lines
+			if self.quote is not None and lines_in_quotes(r, self.sep, self.quote):
+				while True:
+					l = self.file.readline()
+					if not l:
+						self.done = True
+						break
+					self.count = self.count + 1
+
+					r.append(l)
+					if not in_quotes(l, self.sep, self.quote, True):
+						break
+
+			return r
+
+	def mappable(self):
+		return self.path is not None and os.path.isfile(self.path)
+
+	def splittable(self):
+		# Record boundaries cannot be found from arbitrary offsets with quoting
+		return self.mappable() and self.quote is None
+
+	def split(self, num_ranges):
+		"""
+		Splits the file into <num_ranges> byte ranges of roughly equal size.
+		The first <begin> rows are skipped up front.
+		"""
+		with open(self.path, 'rb') as f:
+			for i in range(0, self.begin):
+				if not f.readline():
+					break
+			first = f.tell()
+
+		size = os.path.getsize(self.path)
+
+		num_ranges = max(1, min(num_ranges, (size - first) // RangeDriver.min_size))
+		step = (size - first) // num_ranges
+
+		r = []
+		for i in range(0, num_ranges):
+			start = first + i*step
+			end = size if i == num_ranges-1 else start + step
+			r.append(RangeDriver(self.path, start, end, start > first, self.chunk_size,
+				self.binary, self.quote, self.sep))
+
+		return r
+
+	def sample(self, num_blocks, block_size, rng):
+		"""
+		Stratified sample of the file: Splits the file into <num_blocks>
+		strata and reads lines starting within <block_size> bytes from a
+		random offset in each stratum.
+		"""
+		# Lines at random offsets may be within quoted fields
+		assert(self.splittable())
+
+		r = []
+		for stratum in self.split(num_blocks):
+			start = rng.randint(stratum.start, max(stratum.start, stratum.end - block_size))
+			end = min(start + block_size, stratum.end)
+			r.append(RangeDriver(self.path, start, end,
+				stratum.realign or start > stratum.start, self.chunk_size, self.binary))
+
+		return r
+
+class RangeDriver:
+	"""
+	Reads all lines starting within [start, end) of a regular file.
+	The file is memory-mapped and consumed in blocks of whole lines, which
+	are decoded at once. Each range has its own mapping, so no locking is
+	required.
+	"""
+
+	encoding = "utf8"
+
+	# Minimal number of bytes per range
+	min_size = 64*1024
+
+	# Number of bytes decoded and split at once
+	block_size = 1024*1024
+
+	__slots__ = "file", "map", "path", "start", "end", "realign", "chunk_size", "pos", "done", "lines", "line_idx", "binary", "sep", "quote", "count", "whole_lines"
+	def __init__(self, path, start, end, realign, chunk_size, binary=False, quote=None, sep="|"):
+		self.binary = binary
+		if quote is not None and not isinstance(quote, bytes):
+			quote = quote.encode(self.encoding)
+		if not isinstance(sep, bytes):
+			sep = sep.encode(self.encoding)
+		self.quote = quote
+		self.sep = sep
+		self.file = None
+		self.map = None
+		# Warm pool workers may run in another working directory
+		self.path = os.path.abspath(path)
+		self.start = start
+		self.end = end
+		self.realign = realign
+		self.chunk_size = chunk_size
+		self.pos = start
+		self.done = False
+		self.lines = []
+		self.line_idx = 0
+		self.count = 0
+		# Whether a last line without newline is left out, because a
+		# writer may not have finished it yet
+		self.whole_lines = False
+
+	def _open(self):
+		self.file = open(self.path, 'rb')
+		self.pos = self.start
+
+		if self.start >= self.end:
+			return
+
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if self.realign:
+			# The line crossing 'start' belongs to the previous range
+			nl = self.map.find(b'\n', self.start - 1)
+			self.pos = len(self.map) if nl < 0 else nl + 1
+
+	def _close(self):
+		self.done = True
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	def _next_block(self):
+		# The file may have been truncated since the ranges were planned
+		if self.map is None or self.pos >= min(self.end, len(self.map)):
+			return None
+
+		# Include all lines starting before 'limit'
+		limit = min(self.pos + self.block_size, self.end)
+		nl = self.map.find(b'\n', limit - 1)
+		stop = len(self.map) if nl < 0 else nl + 1
+
+		if self.quote is not None and self.map.find(self.quote, self.pos, stop) >= 0:
+			# Extend block until all quoted fields are closed
+			quoted = lines_in_quotes(self.map[self.pos:stop].split(b'\n'),
+				self.sep, self.quote)
+			while quoted and stop < len(self.map):
+				nl = self.map.find(b'\n', stop)
+				next_stop = len(self.map) if nl < 0 else nl + 1
+				quoted = in_quotes(self.map[stop:next_stop], self.sep, self.quote, True)
+				stop = next_stop
+
+		if self.whole_lines and self.map[stop - 1:stop] != b'\n':
+			# Stop after the last complete line, or record
+			stop = self.map.rfind(b'\n', self.pos, stop) + 1
+			if self.quote is not None and stop > self.pos:
+				(pos, end, quoted) = (self.pos, self.pos, False)
+				for line in self.map[self.pos:stop - 1].split(b'\n'):
+					pos = pos + len(line) + 1
+					quoted = in_quotes(line, self.sep, self.quote, quoted)
+					if not quoted:
+						end = pos
+				stop = end
+			if stop <= self.pos:
+				return None
+
+		if self.binary:
+			lines = self.map[self.pos:stop].split(b'\n')
+		else:
+			lines = self.map[self.pos:stop].decode(self.encoding).split('\n')
+		self.pos = stop
+
+		if len(lines[-1]) == 0:
+			lines.pop()
+		self.count += len(lines)
+		return lines
+
+	def progress(self):
+		return (self.count, max(0, min(self.pos, self.end) - self.start),
+			self.end - self.start)
+
+	def nextTuple(self):
+		if self.done:
+			return None
+		if self.file is None:
+			self._open()
+
+		while self.line_idx >= len(self.lines):
+			block = self._next_block()
+			if block is None:
+				self._close()
+				return None
+
+			self.lines = block
+			self.line_idx = 0
+
+		l = self.lines[self.line_idx]
+		self.line_idx = self.line_idx + 1
+		return l
+
+	def nextMorsel(self):
+		if self.done:
+			return None
+		if self.file is None:
+			self._open()
+
+		if self.line_idx >= len(self.lines):
+			block = self._next_block()
+			if block is None:
+				self._close()
+				return None
+
+			self.lines = block
+			self.line_idx = 0
+
+		# Blocks are handed out in morsels of up to 'chunk_size' lines
+		start = self.line_idx
+		self.line_idx = min(start + self.chunk_size, len(self.lines))
+		if start == 0 and self.line_idx == len(self.lines):
+			return self.lines
+		return self.lines[start:self.line_idx]
+
+	def offset(self):
+		"""
+		Byte offset up to which all lines were returned, None while lines
+		of a block are left
+		"""
+		if self.line_idx < len(self.lines):
+			return None
+		return self.pos
+
+	def splittable(self):
+		return False
+
+def open_zstd(path):
+	if zstandard is None:
+		raise IOError("Reading zstd compressed '{}' requires the 'zstandard' module".format(path))
+	return zstandard.open(path, 'rb')
+
+def open_xz(path):
+	if lzma is None:
+		raise IOError("Reading xz compressed '{}' requires the 'lzma' module".format(path))
+	return lzma.open(path, 'rb')
+
+# Magic bytes of compressed files
+compression_formats = [
+	(b"\x1f\x8b", lambda path: gzip.open(path, 'rb')),
+	(b"BZh", lambda path: bz2.BZ2File(path, 'rb')),
+	(b"\xfd7zXZ\x00", open_xz),
+	(b"\x28\xb5\x2f\xfd", open_zstd),
+]
+
+def open_stdin(path):
+	return os.fdopen(os.dup(sys.stdin.fileno()), 'rb')
+
+def open_raw(path):
+	return open(path, 'rb')
+
+def detect_compression(path):
+	"""
+	Returns a function opening <path> decompressed, or None if <path> is
+	not compressed.
+	"""
+	if not os.path.isfile(path):
+		return None
+
+	with open(path, 'rb') as f:
+		magic = f.read(6)
+
+	for (prefix, opener) in compression_formats:
+		if magic.startswith(prefix):
+			return opener
+
+	return None
+
+class StreamDriver:
+	"""
+	Reads a stream, i.e. a compressed file, a pipe or stdin, in a producer
+	thread and hands out morsels of lines through a bounded queue,
+	overlapping reading and decompression with inference. The morsels of
+	each block are queued together. The producer blocks while the queue
+	is full, so memory stays bounded by the queue size times the block
+	size. Blocks are read into one reused buffer. Consumers that stop
+	early must close() the driver.
+	"""
+
+	encoding = RangeDriver.encoding
 
-		success = self._skip_begin()
-		if not success:
-			return None
+	# Number of decompressed bytes read at once
+	block_size = 1024*1024
 
-		l = self.file.readline()
-		if not l:
-			self.done = True
-			return None
+	# Seconds between checks for close() while the queue is full
+	put_timeout = 0.1
 
-		self.count = self.count + 1
-		return l
+	__slots__ = "path", "opener", "chunk_size", "begin", "queue", "ready", "thread", "stop", "error", "done", "lines", "line_idx", "binary", "sep", "quote", "count", "num_bytes"
+	def __init__(self, path, opener, args, queue_size):
+		self.binary = args.binary
+		(self.sep, self.quote) = quote_tokens(args)
+		self.path = path
+		self.opener = opener
+		assert(args.chunk_size >= 1)
+		self.chunk_size = args.chunk_size
+		self.begin = args.begin
+		self.queue = queue.Queue(max(1, queue_size))
+		# Morsels taken from the queue, shared by all consumers
+		self.ready = deque()
+		self.stop = threading.Event()
+		self.error = None
+		self.done = False
+		self.lines = []
+		self.line_idx = 0
+		self.count = 0
+		self.num_bytes = 0
+
+		self.thread = threading.Thread(target=self._produce)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _produce(self):
+		try:
+			with closing(self.opener(self.path)) as f:
+				skip = self.begin
+				# Lines not handed out yet
+				pending = []
+				# Bytes after the last newline stay at the start of 'buf'
+				buf = bytearray(self.block_size)
+				filled = 0
+				# Python 2 files only fill old-style buffers
+				readinto = getattr(f, "readinto", None) if bytes is not str else None
+
+				while True:
+					if filled == len(buf):
+						# Line longer than the buffer
+						buf = buf + bytearray(len(buf))
+
+					if readinto is not None:
+						num = readinto(memoryview(buf)[filled:])
+					else:
+						data = f.read(len(buf) - filled)
+						num = len(data)
+						buf[filled:filled + num] = data
+
+					if not num:
+						if filled == 0:
+							break
+						# Terminate a last line without newline
+						buf[filled:filled + 1] = b"\n"
+						num = 1
+					else:
+						self.num_bytes += num
+
+					end = filled + num
+					last_nl = buf.rfind(b"\n", filled, end)
+					if last_nl < 0:
+						# Line continues in the next block
+						filled = end
+						continue
+
+					if self.binary:
+						lines = bytes(buf[:last_nl]).split(b'\n')
+					else:
+						lines = buf[:last_nl].decode(self.encoding).split('\n')
+					filled = end - last_nl - 1
+					buf[:filled] = buf[last_nl + 1:end]
+
+					if skip > 0:
+						skipped = min(skip, len(lines))
+						lines = lines[skipped:]
+						skip = skip - skipped
+
+					if pending:
+						lines = pending + lines
+
+					# Cut morsels by index, only copying each line once
+					morsels = []
+					start = 0
+					while len(lines) - start >= self.chunk_size:
+						cut = self._cut(lines, start)
+						if cut is None:
+							break
+						morsels.append(lines[start:cut])
+						start = cut
+					pending = lines[start:]
+
+					if morsels:
+						if not self._put(morsels):
+							return
+						self.count += start
+
+				if pending:
+					if not self._put([pending]):
+						return
+					self.count += len(pending)
+		except Exception as e:
+			self.error = e
+		finally:
+			self._put(None)
+
+	def _put(self, item):
+		"""
+		Queues <item>, unless the driver is closed while the queue is full
+		"""
+		while not self.stop.is_set():
+			try:
+				self.queue.put(item, timeout=self.put_timeout)
+				return True
+			except queue.Full:
+				pass
+
+		return False
+
+	def close(self):
+		"""
+		Stops the producer thread, which then closes the input. A producer
+		waiting for input only notices once the read returns.
+		"""
+		self.stop.set()
+		self.done = True
+		self.ready.clear()
+
+	def _cut(self, lines, start):
+		"""
+		End of the morsel starting at <start>, such that no quoted field is
+		cut. None, if more lines are needed.
+		"""
+		cut = start + self.chunk_size
+		if self.quote is None:
+			return cut
+
+		quoted = lines_in_quotes(lines[start:cut], self.sep, self.quote)
+		while quoted:
+			if cut >= len(lines):
+				return None
+			quoted = in_quotes(lines[cut], self.sep, self.quote, True)
+			cut = cut + 1
+
+		return cut
 
 	def nextMorsel(self):
-		with self.mutex:
-			r = []
+		while True:
+			try:
+				return self.ready.popleft()
+			except IndexError:
+				pass
 
 			if self.done:
 				return None
 
-			success = self._skip_begin()
-			if not success:
+			morsels = self.queue.get()
+			if morsels is None:
+				self.done = True
+				# Wake up other consumers
+				self.queue.put(None)
+
+				if self.error is not None:
+					raise self.error
+				continue
+
+			self.ready.extend(morsels)
+
+	def nextTuple(self):
+		while self.line_idx >= len(self.lines):
+			morsel = self.nextMorsel()
+			if morsel is None:
 				return None
 
-			for i in range(0, self.chunk_size):
-				l = self.file.readline()
-				if not l:
-					self.done = True
-					break
-				self.count = self.count + 1
+			self.lines = morsel
+			self.line_idx = 0
 
-				r.append(l)
+		l = self.lines[self.line_idx]
+		self.line_idx = self.line_idx + 1
+		return l
 
-			return r
+	def progress(self):
+		# Decompressed bytes, the total is unknown up front
+		return (self.count, self.num_bytes, None)
+
+	def splittable(self):
+		return False
 
 import os
 import sys
 import argparse
 import subprocess
 import multiprocessing
-from contextlib import closing
+import pickle
+import random
+import base64
+import json
+import io
+import stat
+import signal
+import socket
+import traceback
+from collections import deque
+from contextlib import closing, contextmanager
+
+clock = getattr(time, "perf_counter", time.time)
+
+class Stats(object):
+	"""
+	Counts and times the stages of a run. Timing wrappers are only
+	installed while collecting, otherwise the hot loop is unchanged.
+	Stages are timed inclusively, e.g. 'push' includes 'date match'. In
+	process mode only stages of the main process are covered.
+	"""
+	__slots__ = "lock", "local", "counters", "start", "originals"
+
+	stages = "read", "push", "date match", "merge"
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.counters = []
+		self.start = clock()
+		self.originals = []
+
+	def _local(self):
+		try:
+			return (self.local.counters, self.local.active)
+		except AttributeError:
+			self.local.counters = {}
+			self.local.active = set()
+			with self.lock:
+				self.counters.append(self.local.counters)
+			return (self.local.counters, self.local.active)
+
+	def add(self, stage, secs):
+		(counters, active) = self._local()
+		entry = counters.get(stage)
+		if entry is None:
+			counters[stage] = [1, secs]
+		else:
+			entry[0] += 1
+			entry[1] += secs
+
+	def timed(self, stage, func):
+		def wrapper(*args, **kwargs):
+			(counters, active) = self._local()
+			if stage in active:
+				# Nested call, already timed
+				return func(*args, **kwargs)
+
+			active.add(stage)
+			start = clock()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				active.discard(stage)
+				self.add(stage, clock() - start)
+		return wrapper
+
+	def timed_methods(self):
+		return [("read", FileDriver, "nextTuple"), ("read", FileDriver, "nextMorsel"),
+			("read", RangeDriver, "nextTuple"), ("read", RangeDriver, "nextMorsel"),
+			("read", StreamDriver, "nextTuple"), ("read", StreamDriver, "nextMorsel"),
+			("push", Table, "push_line"), ("push", Table, "push_lines"),
+			("date match", DateTimeFormatTryAndError, "match_format"),
+			("merge", Table, "merge")]
+
+	def install(self):
+		global stats
+		for (stage, cls, name) in self.timed_methods():
+			func = cls.__dict__[name]
+			self.originals.append((cls, name, func))
+			setattr(cls, name, self.timed(stage, func))
+		stats = self
+
+	def uninstall(self):
+		global stats
+		for (cls, name, func) in self.originals:
+			setattr(cls, name, func)
+		self.originals = []
+		stats = None
+
+	def report(self, table):
+		stages = {}
+		with self.lock:
+			for counters in self.counters:
+				for (stage, (count, secs)) in counters.items():
+					entry = stages.setdefault(stage, {"calls" : 0, "seconds" : 0.0})
+					entry["calls"] += count
+					entry["seconds"] += secs
+
+		columns = []
+		for col in table.columns:
+			checked = {}
+			for name in Column.candidates:
+				checked[name] = col.eliminated.get(name)
+			columns.append({"name" : col.name, "values" : col.num_values,
+				"nulls" : col.num_nulls, "eliminated_after" : checked,
+				"cache_hits" : col.cache_hits, "cache_misses" : col.cache_misses})
+
+		return {"seconds" : clock() - self.start, "rows" : table.line_number,
+			"stages" : stages, "columns" : columns}
+
+# Collects statistics, if not None
+stats = None
+
+def render_stats(report, fmt, f):
+	if fmt == "json":
+		json.dump(report, f, indent=1, sort_keys=True)
+		f.write("\n")
+		return
+
+	f.write("{} rows in {:.3f}s\n".format(report["rows"], report["seconds"]))
+
+	rows = [["Stage", "Calls", "Seconds"]]
+	for stage in Stats.stages:
+		entry = report["stages"].get(stage)
+		if entry is not None:
+			rows.append([stage, str(entry["calls"]), "{:.3f}".format(entry["seconds"])])
+	render_rows(rows, f)
+
+	# Number of values checked until a candidate type got eliminated
+	rows = [["Name", "Values"] + [c.capitalize() for c in Column.candidates] + ["Cache hits"]]
+	for col in report["columns"]:
+		checked = col["eliminated_after"]
+		rows.append([col["name"], str(col["values"])] +
+			["kept" if checked[c] is None else str(checked[c]) for c in Column.candidates] +
+			[str(col["cache_hits"])])
+	render_rows(rows, f)
+
+def render_rows(rows, f):
+	widths = [max(len(row[i]) for row in rows) for i in range(0, len(rows[0]))]
+	out = TtyOutput(widths)
+
+	f.write(out.put_first() + "\n")
+	for (idx, row) in enumerate(rows):
+		if idx > 0:
+			f.write(out.put_linesep() + "\n")
+		f.write(out.put(row) + "\n")
+	f.write(out.put_last() + "\n")
+
+class Worker(object):
+	"""
+	Time a worker spent pushing morsels
+	"""
+	__slots__ = "busy", "progress"
+
+	def __init__(self, progress):
+		self.busy = 0.0
+		self.progress = progress
+
+class FinishedRanges(object):
+	"""
+	Bytes of ranges read by other processes, counted once they finish
+	"""
+	__slots__ = "done", "total"
+
+	def __init__(self, ranges):
+		self.done = 0
+		self.total = sum(driver.end - driver.start for driver in ranges)
+
+	def finish(self, driver):
+		self.done += driver.end - driver.start
+
+	def progress(self):
+		# Rows are counted from the merged table
+		return (0, self.done, self.total)
+
+class Progress(object):
+	"""
+	Periodically prints rows and bytes read by the watched drivers, worker
+	utilization and, if all inputs have a known size, an ETA to stderr.
+	Drivers only maintain their counters per block or morsel, so watching
+	adds no per-row cost.
+	"""
+	__slots__ = "interval", "schema", "out", "drivers", "tables", "count_tables", "workers", "thread", "stopped", "last", "copies", "wanted"
+
+	def __init__(self, interval, schema, out):
+		self.interval = interval
+		self.schema = schema
+		self.out = out
+		self.drivers = []
+		self.tables = []
+		self.count_tables = False
+		self.workers = []
+		self.thread = None
+		self.stopped = threading.Event()
+		self.last = None
+		# Pickled copies of the tables and the tables to copy again, by id
+		self.copies = {}
+		self.wanted = set()
+
+	def watch(self, drivers, tables, count_tables=False):
+		"""
+		Watches <drivers> and takes schema snapshots of <tables>. With
+		<count_tables> rows are counted from the tables, for drivers that
+		run in other processes.
+		"""
+		for driver in drivers:
+			# Shared drivers are handed to several workers
+			if not any(d is driver for d in self.drivers):
+				self.drivers.append(driver)
+		self.tables.extend(tables)
+		self.wanted.update(id(table) for table in tables)
+		self.count_tables = self.count_tables or count_tables
+
+	def worker(self):
+		w = Worker(self)
+		self.workers.append(w)
+		return w
+
+	def start(self):
+		global progress
+		progress = self
+		self.last = self.sample()
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		global progress
+		progress = None
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join()
+
+	def _run(self):
+		while not self.stopped.wait(self.interval):
+			self.report()
+
+	def sample(self):
+		rows = 0
+		num_bytes = 0
+		total = 0
+		for driver in list(self.drivers):
+			(r, b, t) = driver.progress()
+			rows += r
+			num_bytes = None if b is None or num_bytes is None else num_bytes + b
+			total = None if t is None or total is None else total + t
+
+		if self.count_tables:
+			rows = sum(table.line_number for table in self.tables)
+
+		return (clock(), rows, num_bytes, total,
+			[w.busy for w in list(self.workers)])
+
+	def offer(self, table):
+		"""
+		Called between morsels by the thread modifying <table>. Copies the
+		table, if the next snapshot wants it.
+		"""
+		key = id(table)
+		if self.schema and key in self.wanted:
+			self.copies[key] = pickle.dumps(table, pickle.HIGHEST_PROTOCOL)
+			self.wanted.discard(key)
+
+	def snapshot(self):
+		"""
+		Provisional schema merged from the latest copies of the tables,
+		None if there are none yet. Asks for fresh copies.
+		"""
+		snap = None
+		for data in list(self.copies.values()):
+			copy = pickle.loads(data)
+			if snap is None:
+				snap = copy
+			else:
+				snap.merge(copy)
 
-def driver_loop(table, driver, parallel):
-	if parallel:
+		self.wanted = set(id(table) for table in self.tables)
+		if snap is None:
+			return None
+		return [(col.name, col.determine_type()[0]) for col in snap.columns]
+
+	def report(self):
+		(now, rows, num_bytes, total, busy) = cur = self.sample()
+		(then, last_rows, last_bytes, last_total, last_busy) = self.last
+		self.last = cur
+		secs = max(now - then, 1e-9)
+
+		r = ["{} rows".format(rows), "{:.0f} rows/s".format((rows - last_rows) / secs)]
+		if num_bytes is not None and last_bytes is not None:
+			byte_rate = (num_bytes - last_bytes) / secs
+			r.append("{:.1f} MB/s".format(byte_rate / 2**20))
+
+			if total is not None and total > 0:
+				r.append("{:.1f}%".format(100.0 * num_bytes / total))
+				if byte_rate > 0:
+					eta = int((total - num_bytes) / byte_rate)
+					r.append("ETA {}:{:02d}:{:02d}".format(eta // 3600, eta // 60 % 60, eta % 60))
+
+		if len(busy) > 0:
+			r.append("workers " + " ".join("{:.0f}%".format(
+				100.0 * min(1.0, (b - l) / secs)) for (b, l) in zip_longest(busy, last_busy, fillvalue=0.0)))
+
+		self.out.write(", ".join(r) + "\n")
+
+		if self.schema:
+			snap = self.snapshot()
+			if snap is not None:
+				self.out.write("  " + ", ".join("{} {}".format(n, t) for (n, t) in snap) + "\n")
+		self.out.flush()
+
+# Reports progress, if not None
+progress = None
+
+def driver_loop(table, driver, parallel, worker=None):
+	if parallel and worker is not None:
 		while True:
 			lines = driver.nextMorsel()
 			if lines is None:
 				break
 
-			for line in lines:
-				table.push_line(line)
+			start = clock()
+			table.push_lines(lines)
+			worker.busy += clock() - start
+			worker.progress.offer(table)
+	elif parallel:
+		while True:
+			lines = driver.nextMorsel()
+			if lines is None:
+				break
+
+			table.push_lines(lines)
 	else:
 		while True:
 			line = driver.nextTuple()
@@ -451,32 +2651,184 @@ def driver_loop(table, driver, parallel):
 				break
 
 			table.push_line(line)
+			if worker is not None:
+				worker.progress.offer(table)
 
+	table.flush()
 	return table
 
-def schema_main_parallel(master_table, args, drivers):
+def get_parallelism(args):
 	parallelism = args.num_parallel
 
-	if parallelism < 0:
+	if parallelism is None:
+		# Not given, batch mode picks its own default
+		parallelism = 1
+	elif parallelism < 0:
 		parallelism = multiprocessing.cpu_count()
 
-	# Allocate tables
+	return parallelism
+
+# Worker pools kept open across jobs by the server, None otherwise
+warm_pools = None
+
+@contextmanager
+def worker_pool(mode, parallelism):
+	"""
+	Pool of <parallelism> threads or processes. Pools are closed after
+	use, unless the server keeps them warm for later jobs.
+	"""
+	def create():
+		if mode == "process":
+			return multiprocessing.Pool(parallelism)
+		return ThreadPool(processes=parallelism)
+
+	if warm_pools is None:
+		with closing(create()) as pool:
+			yield pool
+		return
+
+	key = (mode, parallelism)
+	if key not in warm_pools:
+		warm_pools[key] = create()
+	yield warm_pools[key]
+
+# Workers get an empty table, with settings applied, pickled as <template>
+# with each task. Thus the same pool serves jobs with different settings.
+
+def process_morsel(template, lines):
+	table = pickle.loads(template)
+	table.push_lines(lines)
+	table.flush()
+
+	# Shipped back via Table.__getstate__()
+	return table
+
+def process_range(template, driver):
+	return driver_loop(pickle.loads(template), driver, True)
+
+# Number of byte ranges per worker, more ranges balance skewed files better
+ranges_per_worker = 4
+
+def plan_drivers(drivers, parallelism):
+	"""
+	Splits regular files into byte ranges of similar size across all
+	files, largest first. Other inputs (stdin, pipes) cannot be split and
+	are returned separately.
+	"""
+	ranges = []
+	streams = []
+	total = 0
+	for driver in drivers:
+		if driver.splittable():
+			total += os.path.getsize(driver.path)
+		else:
+			streams.append(driver)
+
+	range_size = max(1, total // (ranges_per_worker * parallelism))
+	for driver in drivers:
+		if driver.splittable():
+			size = os.path.getsize(driver.path)
+			ranges.extend(driver.split((size + range_size - 1) // range_size))
+
+	ranges.sort(key=lambda driver: driver.end - driver.start, reverse=True)
+	return (ranges, streams)
+
+def steal_loop(table, tasks, worker):
+	"""
+	Pushes drivers taken from the shared <tasks> into <table>, until none
+	are left
+	"""
+	while True:
+		try:
+			driver = tasks.popleft()
+		except IndexError:
+			return table
+
+		driver_loop(table, driver, True, worker)
+
+def schema_main_processes(master_table, args, drivers):
+	parallelism = get_parallelism(args)
+
+	apply_settings([master_table], args)
+	template = pickle.dumps(master_table, pickle.HIGHEST_PROTOCOL)
+
+	(ranges, streams) = plan_drivers(drivers, parallelism)
+	finished = FinishedRanges(ranges)
+
+	if progress is not None:
+		# Ranges are read in the workers, only merged rows and finished
+		# ranges are visible
+		progress.watch(streams + [finished], [master_table], True)
+
+	# Bound the number of morsels in flight, otherwise the reader would
+	# pull the whole input into memory
+	max_pending = 2 * parallelism
+	pending = deque()
+
+	def merge_next():
+		(result, rdriver) = pending.popleft()
+		master_table.merge(result.get())
+		if rdriver is not None:
+			finished.finish(rdriver)
+		if progress is not None:
+			progress.offer(master_table)
+
+	with worker_pool("process", parallelism) as pool:
+		for rdriver in ranges:
+			pending.append((pool.apply_async(process_range, (template, rdriver)), rdriver))
+
+			if len(pending) >= max_pending:
+				merge_next()
+
+		for driver in streams:
+			while True:
+				lines = driver.nextMorsel()
+				if lines is None:
+					break
+				if len(lines) == 0:
+					continue
+
+				pending.append((pool.apply_async(process_morsel, (template, lines)), None))
+
+				if len(pending) >= max_pending:
+					merge_next()
+
+		# wait for remaining and merge in order
+		while pending:
+			merge_next()
+
+	return master_table
+
+def schema_main_parallel(master_table, args, drivers):
+	if args.parallel_mode == "process":
+		return schema_main_processes(master_table, args, drivers)
+
+	parallelism = get_parallelism(args)
+
+	(ranges, streams) = plan_drivers(drivers, parallelism)
+
+	# Each stream is started by one worker, the others join once all
+	# ranges are taken
+	tasks = deque(streams + ranges + streams * (parallelism - 1))
+
+	# One table per worker, reused for all its tasks
 	tables = []
 	for i in range(0, parallelism):
-		for file in drivers:
-			tables.append(Table())
+		tables.append(Table())
 
 	# Set settings
 	apply_settings([master_table] + tables, args)
 
-	with closing(ThreadPool(processes=parallelism)) as pool:
+	with worker_pool("thread", parallelism) as pool:
 		# spawn jobs
 		jobs = []
 
-		for i in range(0, parallelism):
-			for driver in drivers:
-				new_table = tables.pop()
-				jobs.append(pool.apply_async(driver_loop, (new_table, driver, True)))
+		if progress is not None:
+			progress.watch(streams + ranges, tables)
+
+		for new_table in tables:
+			worker = progress.worker() if progress is not None else None
+			jobs.append(pool.apply_async(steal_loop, (new_table, tasks, worker)))
 
 		# wait for all and merge
 		for task in jobs:
@@ -485,33 +2837,571 @@ def schema_main_parallel(master_table, args, drivers):
 	return master_table
 
 
+def schema_types(table):
+	return tuple(col.determine_type()[0] for col in table.columns)
+
+def schema_main_sample(table, args, drivers):
+	"""
+	Reads random blocks of regular files and chunks of other inputs. Stops
+	early, once the schema did not change for <sample_stable> blocks.
+	"""
+	apply_settings([table], args)
+
+	rng = random.Random(args.seed)
+
+	blocks = []
+	for driver in drivers:
+		if driver.splittable():
+			blocks.extend(driver.sample(args.sample, args.sample_block_size, rng))
+		else:
+			blocks.extend([driver] * args.sample)
+
+	# Spread blocks over the whole input, in case we stop early
+	rng.shuffle(blocks)
+
+	types = None
+	num_stable = 0
+	num_blocks = 0
+
+	for block in blocks:
+		if isinstance(block, RangeDriver):
+			driver_loop(table, block, True)
+		else:
+			lines = block.nextMorsel()
+			if lines is None:
+				continue
+
+			table.push_lines(lines)
+		num_blocks = num_blocks + 1
+
+		new_types = schema_types(table)
+		if new_types == types:
+			num_stable = num_stable + 1
+		else:
+			num_stable = 0
+		types = new_types
+
+		if args.sample_stable > 0 and num_stable >= args.sample_stable:
+			break
+
+	table.flush()
+
+	sys.stderr.write("Inspected {} rows in {} sampled blocks\n".format(
+		table.line_number, num_blocks))
+
+	return table
+
+class Checkpoint:
+	"""
+	Inference state together with the byte offsets reached in each file.
+	Resuming continues after these offsets, which also folds rows appended
+	to the files since into the saved state.
+	"""
+	__slots__ = "path", "interval", "options", "offsets", "last_save"
+
+	version = 3
+
+	# Number of bytes at the start of a file identifying it
+	head_size = 4096
+
+	def __init__(self, path, args):
+		self.path = path
+		self.interval = args.checkpoint_interval
+		self.options = (args.seperator, args.null, args.begin, args.date_formats,
+			args.datetime_formats, args.binary, args.quote,
+			args.colnamefile, args.colnamecmd, args.distinct)
+		self.offsets = {}
+		self.last_save = time.time()
+
+	def _head(self, path, size):
+		with open(path, 'rb') as f:
+			return hashlib.sha1(f.read(size)).hexdigest()
+
+	def _valid(self, state):
+		if state.get("version") != self.version or state.get("options") != self.options:
+			return False
+
+		for (path, (offset, head_size, head)) in state["files"].items():
+			if not os.path.isfile(path) or os.path.getsize(path) < offset:
+				return False
+			if self._head(path, head_size) != head:
+				return False
+
+		return True
+
+	def load(self, table, paths):
+		"""
+		Restores <table> from the checkpoint. Returns False, if there is no
+		usable checkpoint.
+		"""
+		if not os.path.isfile(self.path):
+			return False
+
+		with open(self.path, 'rb') as f:
+			state = pickle.load(f)
+
+		paths = set(os.path.abspath(p) for p in paths)
+		if not self._valid(state) or not set(state["files"]).issubset(paths):
+			sys.stderr.write("Ignoring checkpoint '{}' of different input or options\n".format(
+				self.path))
+			return False
+
+		self.offsets = dict((path, entry[0]) for (path, entry) in state["files"].items())
+		table.__setstate__(state["table"].__getstate__())
+		return True
+
+	def offset(self, path):
+		return self.offsets.get(os.path.abspath(path), 0)
+
+	def update(self, path, offset):
+		self.offsets[os.path.abspath(path)] = offset
+
+	def save(self, table):
+		files = {}
+		for (path, offset) in self.offsets.items():
+			head_size = min(offset, self.head_size)
+			files[path] = (offset, head_size, self._head(path, head_size))
+
+		state = {"version" : self.version, "options" : self.options,
+			"files" : files, "table" : table}
+
+		# Atomically replace old checkpoint
+		tmp = self.path + ".tmp"
+		with open(tmp, 'wb') as f:
+			pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+		os.rename(tmp, self.path)
+		self.last_save = time.time()
+
+	def maybe_save(self, table):
+		if time.time() - self.last_save >= self.interval:
+			self.save(table)
+
+def schema_main_checkpoint(table, args):
+	"""
+	Reads the files sequentially, regularly saving a checkpoint at block
+	boundaries. Last lines without newline are part of the result, but
+	not of the checkpoint.
+	"""
+	checkpoint = Checkpoint(args.checkpoint, args)
+	if not checkpoint.load(table, args.files):
+		apply_settings([table], args)
+
+	tails = []
+	for fn in args.files:
+		start = checkpoint.offset(fn)
+		if start == 0:
+			(driver, ) = FileDriver(None, args, fn).split(1)
+		else:
+			driver = RangeDriver(fn, start, os.path.getsize(fn), False,
+				args.chunk_size, args.binary, args.quote, args.seperator)
+		# The saved offset must not point into a line still being written
+		driver.whole_lines = True
+		if progress is not None:
+			progress.watch([driver], [table])
+
+		while True:
+			lines = driver.nextMorsel()
+			if lines is None:
+				break
+
+			table.push_lines(lines)
+			if progress is not None:
+				progress.offer(table)
+			if driver.offset() is not None:
+				checkpoint.update(fn, driver.offset())
+				checkpoint.maybe_save(table)
+
+		table.flush()
+		checkpoint.update(fn, max(start, driver.pos))
+
+		# A writer may not have finished the last line yet, a later run
+		# reads it again
+		tails.append(RangeDriver(fn, max(start, driver.pos), os.path.getsize(fn),
+			False, args.chunk_size, args.binary, args.quote, args.seperator))
+
+	checkpoint.save(table)
+
+	for driver in tails:
+		driver_loop(table, driver, True)
+	return table
+
+class ResultCache:
+	"""
+	Directory of inference states per file, keyed by path, size and
+	modification time of the file and the options affecting inference.
+	Least recently used entries are evicted beyond the size limit.
+	"""
+	__slots__ = "path", "max_size", "options"
+
+	suffix = ".wims"
+
+	def __init__(self, path, args):
+		self.path = path
+		self.max_size = int(args.result_cache_limit * 1024 * 1024)
+		# Column names are not part of the state, names of the final
+		# table take precedence when merging
+		self.options = (profile_version, args.seperator, args.null, args.begin,
+			args.date_formats, args.datetime_formats, args.binary, args.quote,
+			args.distinct)
+
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+	def key(self, fn):
+		st = os.stat(fn)
+		mtime = getattr(st, "st_mtime_ns", st.st_mtime)
+		return repr((os.path.abspath(fn), st.st_size, mtime, self.options))
+
+	def _entry(self, key):
+		return os.path.join(self.path,
+			hashlib.sha1(key.encode('utf8')).hexdigest() + self.suffix)
+
+	def load(self, key):
+		"""
+		Returns the cached table of <key>, None if there is none
+		"""
+		entry = self._entry(key)
+		try:
+			with open(entry, 'rb') as f:
+				state = pickle.load(f)
+		except (IOError, OSError, EOFError, pickle.UnpicklingError):
+			return None
+
+		if not isinstance(state, dict) or state.get("key") != key:
+			return None
+
+		# Mark as recently used
+		os.utime(entry, None)
+		return state["table"]
+
+	def store(self, key, table):
+		entry = self._entry(key)
+		tmp = entry + ".tmp"
+		with open(tmp, 'wb') as f:
+			pickle.dump({"key" : key, "table" : table}, f, pickle.HIGHEST_PROTOCOL)
+		os.rename(tmp, entry)
+
+	def _entries(self):
+		return [os.path.join(self.path, name) for name in os.listdir(self.path)
+			if name.endswith(self.suffix)]
+
+	def evict(self):
+		entries = []
+		for entry in self._entries():
+			st = os.stat(entry)
+			entries.append((st.st_mtime, st.st_size, entry))
+
+		total = sum(size for (mtime, size, entry) in entries)
+		for (mtime, size, entry) in sorted(entries):
+			if total <= self.max_size:
+				break
+			os.remove(entry)
+			total -= size
+
+	def clear(self):
+		for entry in self._entries():
+			os.remove(entry)
+
+def schema_main_cached(table, args):
+	"""
+	Loads states of unchanged files from the result cache and only scans
+	new or changed files, which are added to the cache
+	"""
+	cache = ResultCache(args.result_cache, args)
+	apply_settings([table], args)
+
+	for fn in args.files:
+		if not os.path.isfile(fn):
+			# Pipes have no identity
+			key = None
+			file_table = None
+		else:
+			key = cache.key(fn)
+			file_table = cache.load(key)
+
+		if file_table is None:
+			file_args = argparse.Namespace(**vars(args))
+			file_args.files = [fn]
+			file_args.result_cache = None
+			file_table = schema_main(Table(), file_args)
+			file_table.check()
+
+			if key is not None:
+				cache.store(key, file_table)
+
+		table.merge(file_table)
+
+	cache.evict()
+	return table
+
+def schema_validate(validator, args):
+	"""
+	Pushes the input files in order into <validator>, until it has seen
+	enough violations
+	"""
+	apply_settings([validator], args)
+	validator.binary = False
+	validator.compile()
+
+	text_args = argparse.Namespace(**vars(args))
+	text_args.binary = False
+
+	for fn in args.files or [None]:
+		if validator.full():
+			break
+
+		if fn is None:
+			driver = StreamDriver(None, open_stdin, text_args, 2)
+		elif detect_compression(fn) is not None:
+			driver = StreamDriver(fn, detect_compression(fn), text_args, 2)
+		elif not os.path.isfile(fn):
+			driver = StreamDriver(fn, open_raw, text_args, 2)
+		else:
+			(driver, ) = FileDriver(None, text_args, fn).split(1)
+
+		validator.path = "<stdin>" if fn is None else fn
+		validator.line_number = args.begin
+		try:
+			while not validator.full():
+				lines = driver.nextMorsel()
+				if lines is None:
+					break
+				validator.push_lines(lines)
+		finally:
+			if isinstance(driver, StreamDriver):
+				driver.close()
+		validator.flush()
+
+	return validator
+
 def schema_main(table, args):
 	drivers = []
 	files = []
 
+	if args.result_cache is not None:
+		return schema_main_cached(table, args)
+
+	if args.checkpoint is not None:
+		return schema_main_checkpoint(table, args)
+
 	try:
 		if len(args.files) == 0:
-			drivers = [FileDriver(os.fdopen(os.dup(sys.stdin.fileno())), args)]
+			drivers = [StreamDriver(None, open_stdin, args,
+				2 * max(1, get_parallelism(args)))]
 		else:
-			files = list(map(lambda fn: open(fn, 'r'), args.files))
-			drivers = list(map(lambda x: FileDriver(x, args), files))
+			for fn in args.files:
+				opener = detect_compression(fn)
+				if opener is None and not os.path.isfile(fn):
+					# Pipes and devices cannot be mapped
+					opener = open_raw
+				if opener is not None:
+					drivers.append(StreamDriver(fn, opener, args,
+						2 * max(1, get_parallelism(args))))
+					continue
+
+				driver = FileDriver(None, args, fn)
+				if not driver.splittable():
+					# Read line by line, unless split into ranges
+					driver.file = open(fn, 'rb' if args.binary else 'r')
+					files.append(driver.file)
+				drivers.append(driver)
 
+		if args.sample > 0:
+			return schema_main_sample(table, args, drivers)
 
-		if args.num_parallel != 1:
+		if get_parallelism(args) != 1:
 			return schema_main_parallel(table, args, drivers)
 
 		apply_settings([table], args)
 
+		jobs = []
 		for driver in drivers:
-			driver_loop(table, driver, False)
+			if isinstance(driver, FileDriver) and driver.mappable():
+				# Read regular files block-wise via mmap
+				jobs.extend((rdriver, True) for rdriver in driver.split(1))
+			elif isinstance(driver, StreamDriver):
+				jobs.append((driver, True))
+			else:
+				jobs.append((driver, False))
+
+		worker = None
+		if progress is not None:
+			progress.watch([driver for (driver, parallel) in jobs], [table])
+			worker = progress.worker()
+
+		for (driver, parallel) in jobs:
+			driver_loop(table, driver, parallel, worker)
 
 	finally:
+		for driver in drivers:
+			if isinstance(driver, StreamDriver):
+				driver.close()
 		for f in files:
 			f.close()
 		drivers = []
 
 	return table
 
+# Files are grouped into batch tasks of up to this many bytes or files
+batch_group_bytes = 4*1024*1024
+batch_group_files = 256
+
+def plan_batch(files, parallelism):
+	"""
+	Groups <files> into tasks, largest first. Small files share a task,
+	but every worker gets several tasks to balance skewed sizes.
+	"""
+	sizes = [(os.path.getsize(fn) if os.path.isfile(fn) else 0, fn) for fn in files]
+	sizes.sort(key=lambda entry: entry[0], reverse=True)
+
+	total = sum(size for (size, fn) in sizes)
+	group_bytes = max(1, min(batch_group_bytes, total // (ranges_per_worker * parallelism)))
+
+	tasks = []
+	group = []
+	group_size = 0
+	for (size, fn) in sizes:
+		group.append(fn)
+		group_size += size
+		if group_size >= group_bytes or len(group) >= batch_group_files:
+			tasks.append(group)
+			group = []
+			group_size = 0
+	if group:
+		tasks.append(group)
+
+	return tasks
+
+def batch_task(task):
+	"""
+	Infers the schema of each file of <task> on its own. Paths are
+	relative to <cwd>. Returns (path, table, error) per file.
+	"""
+	(args, names, paths, cwd) = task
+
+	r = []
+	for fn in paths:
+		file_args = argparse.Namespace(**vars(args))
+		file_args.files = [os.path.join(cwd, fn)]
+
+		table = Table()
+		for name in names:
+			table.columns.append(Column(table, name))
+
+		try:
+			schema_main(table, file_args)
+			table.check()
+		except (IOError, OSError, ValueError) as e:
+			r.append((fn, None, str(e)))
+			continue
+
+		# Shipped back via Table.__getstate__()
+		r.append((fn, table, None))
+
+	return r
+
+# Version of files written by save_profile()
+profile_version = 4
+
+# Classes restored from profiles, other objects are rejected
+profile_classes = dict((cls.__name__, cls) for cls in
+	(Table, Column, MinMax, DateTimeFormatTryAndError, DistinctSketch))
+
+def encode_state(value):
+	"""
+	Converts <value> into JSON types. Objects are stored as their
+	__getstate__(), bytes as base64.
+	"""
+	if isinstance(value, (list, tuple)):
+		return [encode_state(v) for v in value]
+	if isinstance(value, dict):
+		return dict((k, encode_state(v)) for (k, v) in value.items())
+	if isinstance(value, bytes):
+		return {"bytes" : base64.b64encode(value).decode('ascii')}
+	# Also covers old-style classes of Python 2
+	cls = value.__class__
+	if profile_classes.get(cls.__name__) is cls:
+		return {"class" : cls.__name__, "state" : encode_state(value.__getstate__())}
+	return value
+
+def decode_state(value):
+	if isinstance(value, list):
+		return [decode_state(v) for v in value]
+	if not isinstance(value, dict):
+		return value
+
+	if "bytes" in value:
+		return base64.b64decode(value["bytes"].encode('ascii'))
+	if "class" in value:
+		if value["class"] not in profile_classes:
+			raise ValueError("Unknown class '{}'".format(value["class"]))
+		cls = profile_classes[value["class"]]
+		obj = cls() if cls is Table else cls.__new__(cls)
+		obj.__setstate__(decode_state(value["state"]))
+		return obj
+	return dict((k, decode_state(v)) for (k, v) in value.items())
+
+def save_profile(path, table):
+	"""
+	Writes the inference state of <table> as partial profile, which can be
+	merged with profiles of other parts of the data
+	"""
+	with open(path, 'w') as f:
+		json.dump({"version" : profile_version, "table" : encode_state(table)}, f)
+
+def load_profile(path):
+	with open(path, 'r') as f:
+		try:
+			state = json.load(f)
+		except ValueError:
+			state = None
+
+	if not isinstance(state, dict) or state.get("version") != profile_version:
+		raise ValueError("'{}' is not a profile of version {}".format(path, profile_version))
+
+	table = decode_state(state["table"])
+	if not isinstance(table, Table):
+		raise ValueError("'{}' is not a profile of version {}".format(path, profile_version))
+	return table
+
+def merge_profiles(paths):
+	table = None
+	for path in paths:
+		other = load_profile(path)
+		if table is None:
+			table = other
+			continue
+
+		for (option, desc) in [("seperator", "separator"), ("parent_null_value", "NULL value"),
+				("binary", "--binary option"), ("quote", "quote")]:
+			if getattr(other, option) != getattr(table, option):
+				raise ValueError("'{}' was written with a different {} than '{}'".format(
+					path, desc, paths[0]))
+		table.merge(other)
+
+	return table
+
+def load_schema(f):
+	"""
+	Parses a schema as printed with or without --create-table. Returns
+	(name, type, nullable) per column.
+	"""
+	column = re.compile(r'\s*"?([^"\s]+)"?\s+(\w+\s*(?:\(\s*\d+\s*(?:,\s*\d+\s*)?\))?)(\s+NOT\s+NULL)?\s*,?\s*(?:--.*)?\Z',
+		re.IGNORECASE)
+
+	r = []
+	for line in f:
+		line = line.strip()
+		if len(line) == 0 or line.upper().startswith("CREATE TABLE") or line.startswith(")"):
+			continue
+
+		m = column.match(line)
+		if m is None:
+			raise ValueError("Cannot parse column '{}'".format(line))
+		r.append((m.group(1), m.group(2), m.group(3) is None))
+
+	return r
+
 def load_column_info(table, f):
 	r = []
 	for line in f:
@@ -528,17 +3418,25 @@ def apply_settings(tables, args):
 	colfile = []
 	if args.colnamefile:
 		with open(args.colnamefile) as f:
-			colfile = load_column_info(table, f)
+			colfile = load_column_info(None, f)
 
 	colcmd = []
 	if args.colnamecmd:
 		cmd = subprocess.Popen(args.colnamecmd, shell=True, stdout=subprocess.PIPE)
-		colcmd = load_column_info(table, cmd.communicate()[0].decode('ascii', 'ignore'))
+		colcmd = load_column_info(None, cmd.communicate()[0].decode('ascii', 'ignore').splitlines())
 
 	for table in tables:
 		table.seperator = args.seperator
 		if args.null:
 			table.parent_null_value = args.null
+		if args.date_formats:
+			table.date_formats.extend(args.date_formats)
+		if args.datetime_formats:
+			table.datetime_formats.extend(args.datetime_formats)
+		table.cache_size = args.cache_size
+		table.binary = args.binary
+		table.quote = args.quote
+		table.distinct = args.distinct
 
 		for line in colfile:
 			table.columns.append(Column(table, line))
@@ -625,6 +3523,7 @@ class TerminalOutput(object):
 				filter(lambda col: col.num_values > 0,
 					table.columns)))
 		num_cols = len(print_cols)
+		distinct = any(col.distinct is not None for (col, tpe_str) in print_cols)
 
 		if self.create_table:
 			print("CREATE TABLE \"{}\" (".format(self.create_table))
@@ -640,18 +3539,25 @@ class TerminalOutput(object):
 					n=col.name, t=tpe_str,
 					a=" NOT NULL" if col.num_nulls == 0 else "")
 
-				print("{t}{post}".format(
+				print("{t}{post}{c}".format(
 					t=t,
-					post="" if last_col else ","))
+					post="" if last_col else ",",
+					c=" -- ~{} distinct".format(col.distinct.estimate())
+						if col.distinct is not None else ""))
 			print(");")
 
 			return
 
 		if not self.tty_table:
 			for (col, tpe_str) in print_cols:
-				print("{n} {t}{a}".format(
+				print("{n} {t}{a}{c}".format(
 					n=col.name, t=tpe_str,
-					a=" NOT NULL" if col.num_nulls == 0 else ""))
+					a=" NOT NULL" if col.num_nulls == 0 else "",
+					c=" -- ~{} distinct".format(col.distinct.estimate())
+						if col.distinct is not None else ""))
+			return
+
+		if num_cols == 0:
 			return
 
 		w_name = 0
@@ -662,28 +3568,67 @@ class TerminalOutput(object):
 			w_name = max(w_name, len(col.name))
 			w_type = max(w_type, len(tpe_str))
 
-		out = TtyOutput([w_name, w_type, w_null])
+		header = ["Name", "Type", "Null"]
+		widths = [w_name, w_type, w_null]
+		if distinct:
+			estimates = [str(col.distinct.estimate()) if col.distinct is not None else ""
+				for (col, tpe_str) in print_cols]
+			header.append("Distinct")
+			widths.append(max([len("Distinct")] + list(map(len, estimates))))
+
+		out = TtyOutput(widths)
 
 		first = True
 
 		if not self.no_header:
 			print(out.put_first())
-			print(out.put(["Name", "Type", "Null"]))
+			print(out.put(header))
 			first = False
 
-		for (col, tpe_str) in print_cols:
+		for (idx, (col, tpe_str)) in enumerate(print_cols):
 			if first:
 				first = False
 			else:
 				print(out.put_linesep())
 
-			print(out.put([col.name, tpe_str,  "NOT NULL" if col.num_nulls == 0 else ""]))
+			row = [col.name, tpe_str,  "NOT NULL" if col.num_nulls == 0 else ""]
+			if distinct:
+				row.append(estimates[idx])
+			print(out.put(row))
 
 		print(out.put_last())
 
-def main():
+def merge_main(argv):
+	parser = argparse.ArgumentParser(
+		prog="whatismyschema.py merge",
+		description="""Determine SQL schema by merging partial profiles written with --save-profile."""
+	)
+
+	parser.add_argument('profiles', metavar='PROFILES', nargs='+',
+		help='Profiles to merge')
+	parser.add_argument("--create-table", dest="sql", type=str,
+		help="Creates SQL schema using given table name")
+	parser.add_argument("--no-header", dest="no_table_header",
+		help="Print no table header", action='store_true')
+	parser.set_defaults(no_table_header=False)
+
+	args = parser.parse_args(argv)
+
+	try:
+		table = merge_profiles(args.profiles)
+	except (IOError, ValueError) as e:
+		parser.error(str(e))
+	table.check()
+
+	output = TerminalOutput(args)
+
+	output.render(table)
+	return table
+
+def build_parser():
 	parser = argparse.ArgumentParser(
-		description="""Determine SQL schema from CSV data."""
+		description="""Determine SQL schema from CSV data.""",
+		epilog="""Use '%(prog)s merge PROFILES' to merge profiles written with --save-profile."""
 	)
 
 	parser.add_argument('files', metavar='FILES', nargs='*',
@@ -700,27 +3645,395 @@ def main():
 		help="Loads column names from file")
 	parser.add_argument("--colnamecmd", dest="colnamecmd", type=str,
 		help="Loads column names from command's stdout")
+	parser.add_argument("--date-format", dest="date_formats", type=str, action='append',
+		help="Also detects dates in strptime() format <DATE_FORMATS>. Can be given multiple times")
+	parser.add_argument("--datetime-format", dest="datetime_formats", type=str, action='append',
+		help="Also detects datetimes in strptime() format <DATETIME_FORMATS>. Can be given multiple times")
+	parser.add_argument("--binary", dest="binary",
+		help="Classifies raw bytes, only decoding non-ASCII values and date candidates", action='store_true')
+	parser.set_defaults(binary=False)
+	parser.add_argument("--quote", dest="quote", type=str,
+		help="Fields enclosed in <QUOTE> may contain separators and newlines (RFC 4180). Default is no quoting.")
+	parser.add_argument("--cache-size", dest="cache_size", type=int,
+		help="Caches classifications of up to <CACHE_SIZE> distinct values per column. 0 disables caching. Default is 4096.", default="4096")
+	parser.add_argument("--distinct", dest="distinct",
+		help="Estimates the number of distinct values per column in fixed memory", action='store_true')
+	parser.set_defaults(distinct=False)
 	parser.add_argument("--no-header", dest="no_table_header",
 		help="Print no table header", action='store_true')
 	parser.set_defaults(no_table_header=False)
 	parser.add_argument("-P", "--parallelism", "--parallel", dest="num_parallel", type=int,
-		help="Parallelizes using <NUM_PARALLEL> threads. If <NUM_PARALLEL> is less than 0 the degree of parallelism will be chosen.", default="1")
+		help="Parallelizes using <NUM_PARALLEL> threads or processes, see --parallel-mode. If <NUM_PARALLEL> is less than 0 the degree of parallelism will be chosen. Default is 1, one process per CPU with --batch.")
 	parser.add_argument("--parallel-chunk-size", dest="chunk_size", type=int,
-		help="Sets chunk size for parallel reading. Default is 16k lines.", default="16384")
+		help="Hands input to workers in morsels of <CHUNK_SIZE> lines. Default is 16k lines.", default="16384")
+	parser.add_argument("--parallel-mode", dest="parallel_mode", type=str,
+		choices=["thread", "process"],
+		help="Parallelizes using threads or processes. Default is thread.", default="thread")
+
+	parser.add_argument("--sample", dest="sample", type=int,
+		help="Only reads <SAMPLE> randomly chosen blocks per file. Stdin is read in <SAMPLE> chunks from the start.", default="0")
+	parser.add_argument("--sample-block-size", dest="sample_block_size", type=int,
+		help="Size of sampled blocks in bytes. Default is 64k.", default="65536")
+	parser.add_argument("--sample-stable", dest="sample_stable", type=int,
+		help="Stops sampling once the schema did not change for <SAMPLE_STABLE> blocks.", default="0")
+	parser.add_argument("--seed", dest="seed", type=int,
+		help="Seed for sampling.", default="0")
+
+	parser.add_argument("--save-profile", dest="save_profile", type=str,
+		help="Writes the inference state to <SAVE_PROFILE>. Profiles of several runs can be combined using the merge command.")
+	parser.add_argument("--checkpoint", dest="checkpoint", type=str,
+		help="Regularly saves the inference state to <CHECKPOINT> and resumes from it. Rows appended to the files since the checkpoint are added to the saved state. Reads sequentially.")
+	parser.add_argument("--checkpoint-interval", dest="checkpoint_interval", type=float,
+		help="Saves a checkpoint every <CHECKPOINT_INTERVAL> seconds. Default is 60.", default="60")
+
+	parser.add_argument("--result-cache", dest="result_cache", type=str,
+		help="Caches the inference state per file in directory <RESULT_CACHE>. Only new or changed files are read.")
+	parser.add_argument("--result-cache-limit", dest="result_cache_limit", type=float,
+		help="Evicts least recently used entries beyond <RESULT_CACHE_LIMIT> MB. Default is 256.", default="256")
+	parser.add_argument("--result-cache-clear", dest="result_cache_clear",
+		help="Removes all entries of the result cache first. Exits, if no files are given.", action='store_true')
+	parser.set_defaults(result_cache_clear=False)
+
+	parser.add_argument("--validate", dest="validate", type=str,
+		help="Only checks, whether the data fits the schema in file <VALIDATE>, as printed with or without --create-table. Prints violations and exits with status 1, if there are any. Reads sequentially.")
+	parser.add_argument("--max-violations", dest="max_violations", type=int,
+		help="Stops validating after <MAX_VIOLATIONS> violations. 0 reports all. Default is 1.", default="1")
+
+	parser.add_argument("--batch", dest="batch", type=str,
+		choices=["table", "jsonl"],
+		help="Infers one schema per file instead of merging them and prints each once its file is done, as table or JSON lines. With --create-table, {} in the name is replaced by the file name.")
+
+	parser.add_argument("--progress", dest="progress", type=float,
+		help="Prints progress to stderr every <PROGRESS> seconds. Default is 0, no progress.", default="0")
+	parser.add_argument("--progress-schema", dest="progress_schema",
+		help="Also prints a provisional schema with each progress report", action='store_true')
+	parser.set_defaults(progress_schema=False)
+	parser.add_argument("--stats", dest="stats", type=str,
+		choices=["table", "json"],
+		help="Prints time spent per stage and number of values checked per candidate type to stderr")
+
+	parser.add_argument("--serve", dest="serve", type=str,
+		help="Runs as server on Unix socket <SERVE>, avoiding start-up costs per run. Jobs run one at a time.")
+	parser.add_argument("--connect", dest="connect", type=str,
+		help="Runs on the server listening on Unix socket <CONNECT>. whatismyschema_client.py is a faster starting client.")
+
+	return parser
+
+def run_main(args, parser):
+	if args.checkpoint is not None:
+		if args.sample > 0 or len(args.files) == 0:
+			parser.error("--checkpoint requires input files and cannot be used with --sample")
+		for fn in args.files:
+			if not os.path.isfile(fn) or detect_compression(fn) is not None:
+				parser.error("--checkpoint requires uncompressed regular files, '{}' is not".format(fn))
+
+	if args.result_cache is not None:
+		if args.sample > 0 or args.checkpoint is not None:
+			parser.error("--result-cache cannot be used with --sample or --checkpoint")
+
+		if args.result_cache_clear:
+			ResultCache(args.result_cache, args).clear()
+			if len(args.files) == 0:
+				return None
+		elif len(args.files) == 0:
+			parser.error("--result-cache requires input files")
 
-	args = parser.parse_args()
+	if args.validate is not None:
+		return validate_main(args, parser)
+
+	if args.batch is not None:
+		return batch_main(args, parser)
 
 	# multithreading issue with datetime.strptime() and Python 2
 	strptime = datetime.strptime
 
+	if args.stats:
+		Stats().install()
+
+	if args.progress > 0:
+		Progress(args.progress, args.progress_schema, sys.stderr).start()
+
 	table = Table()
 
 	schema_main(table, args)
 	table.check()
 
+	if progress is not None:
+		progress.stop()
+
+	if stats is not None:
+		render_stats(stats.report(table), args.stats, sys.stderr)
+
+	if args.save_profile:
+		save_profile(args.save_profile, table)
+
 	output = TerminalOutput(args)
 
 	output.render(table)
+	return table
+
+def validate_main(args, parser):
+	if (args.sample > 0 or args.checkpoint is not None or args.result_cache is not None or
+			args.batch is not None):
+		parser.error("--validate cannot be used with --sample, --checkpoint, --result-cache or --batch")
+
+	try:
+		with open(args.validate) as f:
+			schema = load_schema(f)
+		validator = Validator(schema, args.max_violations)
+	except (IOError, ValueError) as e:
+		parser.error("Invalid schema '{}': {}".format(args.validate, e))
+
+	schema_validate(validator, args)
+
+	for (path, row, idx, attr) in validator.violations:
+		if idx < len(schema):
+			(name, tpe, nullable) = schema[idx]
+			print("{}:{}: {} '{}' does not fit {}{}".format(path, row, name, attr, tpe,
+				"" if nullable else " NOT NULL"))
+		else:
+			print("{}:{}: Unexpected column col{} '{}'".format(path, row, idx, attr))
+
+	if validator.violations:
+		sys.exit(1)
+
+def table_columns(table):
+	r = []
+	for col in table.columns:
+		if col.num_values == 0:
+			continue
+
+		info = {"name" : col.name, "type" : col.determine_type()[0],
+			"nullable" : col.num_nulls > 0}
+		if col.distinct is not None:
+			info["distinct"] = col.distinct.estimate()
+		r.append(info)
+
+	return r
+
+def batch_main(args, parser):
+	if len(args.files) == 0:
+		parser.error("--batch requires input files")
+	if (args.checkpoint is not None or args.result_cache is not None or
+			args.save_profile or args.progress > 0 or args.stats):
+		parser.error("--batch cannot be used with --checkpoint, --result-cache, --save-profile, --progress or --stats")
+
+	parallelism = multiprocessing.cpu_count()
+	if args.num_parallel is not None:
+		parallelism = get_parallelism(args)
+
+	# Resolve column names once, instead of per file
+	names_table = Table()
+	apply_settings([names_table], args)
+	names = [col.name for col in names_table.columns]
+
+	file_args = argparse.Namespace(**vars(args))
+	(file_args.batch, file_args.num_parallel) = (None, 1)
+	(file_args.colnamefile, file_args.colnamecmd) = (None, None)
+	# Warm pool workers may run in another working directory
+	tasks = [(file_args, names, paths, os.getcwd())
+		for paths in plan_batch(args.files, parallelism)]
+
+	output = TerminalOutput(args)
+	failed = [False]
+
+	def emit(results):
+		for (fn, table, error) in results:
+			if args.batch == "jsonl":
+				if error is not None:
+					record = {"file" : fn, "error" : error}
+				else:
+					record = {"file" : fn, "columns" : table_columns(table)}
+				print(json.dumps(record, sort_keys=True))
+			elif error is not None:
+				sys.stderr.write("{}: {}\n".format(fn, error))
+			elif args.sql:
+				print("-- {}".format(fn))
+				output.create_table = args.sql.replace("{}", os.path.basename(fn).split(".")[0])
+				output.render(table)
+			else:
+				print("==> {} <==".format(fn))
+				output.render(table)
+
+			if error is not None:
+				failed[0] = True
+
+		# Stream results as files finish
+		sys.stdout.flush()
+
+	if parallelism == 1:
+		for task in tasks:
+			emit(batch_task(task))
+	else:
+		with worker_pool("process", parallelism) as pool:
+			for results in pool.imap_unordered(batch_task, tasks):
+				emit(results)
+
+	if failed[0]:
+		sys.exit(1)
+
+class CapturedOutput(io.StringIO):
+	"""
+	Collects the output of a job on the server, as if written to a
+	terminal if <tty>
+	"""
+	def __init__(self, tty):
+		io.StringIO.__init__(self)
+		self.tty = tty
+
+	def isatty(self):
+		return self.tty
+
+	def write(self, s):
+		# Python 2 prints byte strings
+		if isinstance(s, bytes):
+			s = s.decode("utf-8")
+		return io.StringIO.write(self, s)
+
+def serve_job(conn, request, parser):
+	"""
+	Runs the job <request> with the client's working directory, stdin and
+	output. Returns the response.
+	"""
+	from whatismyschema_client import send_message
+
+	(stdin, stdout, stderr, cwd) = (sys.stdin, sys.stdout, sys.stderr, os.getcwd())
+	out = CapturedOutput(bool(request.get("tty")))
+	err = CapturedOutput(False)
+	status = 0
+	table = None
+	announced = False
+
+	try:
+		(sys.stdout, sys.stderr) = (out, err)
+		os.chdir(request["cwd"])
+
+		argv = request["argv"]
+		if argv[:1] == ["merge"]:
+			# Only reads profiles
+			send_message(conn, {"stdin" : False})
+			announced = True
+			table = merge_main(argv[1:])
+		else:
+			args = parser.parse_args(argv)
+			if args.serve is not None:
+				parser.error("--serve cannot be used with --connect")
+
+			send_message(conn, {"stdin" : len(args.files) == 0})
+			announced = True
+			if len(args.files) == 0:
+				# Read until the client shuts down writing
+				sys.stdin = conn.makefile('rb')
+
+			table = run_main(args, parser)
+	except SystemExit as e:
+		if e.code is None or isinstance(e.code, int):
+			status = e.code or 0
+		else:
+			err.write(u"{}\n".format(e.code))
+			status = 1
+	except Exception:
+		err.write(u"{}".format(traceback.format_exc()))
+		status = 1
+	finally:
+		if sys.stdin is not stdin:
+			sys.stdin.close()
+		(sys.stdin, sys.stdout, sys.stderr) = (stdin, stdout, stderr)
+		os.chdir(cwd)
+
+		if progress is not None:
+			progress.stop()
+		if stats is not None:
+			stats.uninstall()
+
+	if not announced:
+		send_message(conn, {"stdin" : False})
+
+	# Skip unread input, the client only reads the response once sent
+	while conn.recv(65536):
+		pass
+
+	columns = None
+	if table is not None:
+		columns = table_columns(table)
+
+	return {"status" : status, "stdout" : out.getvalue(),
+		"stderr" : err.getvalue(), "columns" : columns}
+
+def serve(path, parser):
+	"""
+	Accepts jobs, i.e. command lines, on Unix socket <path> and runs them
+	one after the other. Thread and process pools stay warm across jobs.
+	"""
+	from whatismyschema_client import send_message, recv_message
+	global warm_pools
+
+	if os.path.exists(path):
+		if not stat.S_ISSOCK(os.stat(path).st_mode):
+			parser.error("'{}' exists and is no socket".format(path))
+
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(path)
+			parser.error("A server is already listening on '{}'".format(path))
+		except socket.error:
+			# Left over by a server that did not shut down
+			os.unlink(path)
+		finally:
+			probe.close()
+
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	server.bind(path)
+	server.listen(64)
+	warm_pools = {}
+
+	# Clean up on termination as well, also while a job runs, whose
+	# SystemExit is caught. Forked pool workers inherit the handler.
+	pid = os.getpid()
+	def terminate(signum, frame):
+		if os.getpid() != pid:
+			sys.exit(0)
+		raise KeyboardInterrupt()
+	signal.signal(signal.SIGTERM, terminate)
+
+	try:
+		while True:
+			(conn, addr) = server.accept()
+			with closing(conn):
+				try:
+					request = recv_message(conn)
+					send_message(conn, serve_job(conn, request, parser))
+				except (IOError, OSError, ValueError, KeyError) as e:
+					sys.stderr.write("Dropped job: {}\n".format(e))
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.close()
+		os.unlink(path)
+		for pool in warm_pools.values():
+			pool.terminate()
+		warm_pools = None
+
+def main():
+	if sys.argv[1:2] == ["merge"]:
+		return merge_main(sys.argv[2:])
+
+	if sys.argv[1:2] == ["--connect"]:
+		# Forwards the command line like the client, also for merge
+		from whatismyschema_client import main as client_main
+		return client_main()
+
+	parser = build_parser()
+	args = parser.parse_args()
+
+	if args.serve is not None:
+		return serve(args.serve, parser)
+
+	if args.connect is not None:
+		from whatismyschema_client import client_main
+		sys.exit(client_main(args.connect, sys.argv[1:]))
+
+	run_main(args, parser)
 
 
 if __name__ == '__main__':
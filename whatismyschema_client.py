@@ -0,0 +1,88 @@
+#!/bin/env python
+# coding: utf8
+#
+# WhatIsMySchema
+#
+# Copyright (c) 2018 Tim Gubner
+#
+#
+
+# Client of 'whatismyschema.py --serve SOCKET'. It only uses a few
+# standard modules, such that it starts quickly.
+#
+# Protocol, all messages are JSON prefixed by their length (4 bytes,
+# big endian):
+#   client -> server: {"argv" : [...], "cwd" : "...", "tty" : bool}
+#   server -> client: {"stdin" : bool}, whether the job reads stdin.
+#                     If so, the client streams its stdin after this.
+#   client:           shuts down writing
+#   server -> client: {"status" : int, "stdout" : "...", "stderr" : "...",
+#                     "columns" : [{"name", "type", "nullable"}, ...]}
+
+import os
+import sys
+import json
+import struct
+import socket
+from contextlib import closing
+
+def send_message(sock, msg):
+	data = json.dumps(msg).encode('utf8')
+	sock.sendall(struct.pack(">I", len(data)) + data)
+
+def recv_exactly(sock, size):
+	r = b""
+	while len(r) < size:
+		data = sock.recv(size - len(r))
+		if not data:
+			raise IOError("Connection closed")
+		r = r + data
+	return r
+
+def recv_message(sock):
+	(size, ) = struct.unpack(">I", recv_exactly(sock, 4))
+	return json.loads(recv_exactly(sock, size).decode('utf8'))
+
+def client_main(path, argv):
+	"""
+	Runs the job given by command line <argv> on the server listening on
+	<path>. Returns the exit status.
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	with closing(sock):
+		sock.connect(path)
+		send_message(sock, {"argv" : argv, "cwd" : os.getcwd(),
+			"tty" : sys.stdout.isatty()})
+
+		if recv_message(sock)["stdin"]:
+			with os.fdopen(os.dup(sys.stdin.fileno()), 'rb') as f:
+				while True:
+					data = f.read(1024*1024)
+					if not data:
+						break
+					sock.sendall(data)
+		sock.shutdown(socket.SHUT_WR)
+
+		response = recv_message(sock)
+
+	sys.stdout.write(response["stdout"])
+	sys.stderr.write(response["stderr"])
+	return response["status"]
+
+def main():
+	argv = sys.argv[1:]
+	path = os.environ.get("WHATISMYSCHEMA_SOCKET")
+	if argv[:1] == ["--connect"] and len(argv) > 1:
+		path = argv[1]
+		argv = argv[2:]
+
+	if path is None:
+		sys.stderr.write("usage: {} --connect SOCKET [whatismyschema.py options] [FILES]\n".format(
+			os.path.basename(sys.argv[0])))
+		sys.exit(2)
+
+	sys.exit(client_main(path, argv))
+
+
+if __name__ == '__main__':
+	main()